@@ -0,0 +1,5 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : __init__.py
+@Description: Benchmarks which run against local servers.
+'''
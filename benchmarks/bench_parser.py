@@ -0,0 +1,83 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : bench_parser.py
+@Description: Micro-benchmark of parsing fixture pages with every backend,
+              parsing the whole page versus the needed elements only.
+
+Usage:
+    python -m benchmarks.bench_parser [--repeat N]
+'''
+
+import argparse
+import importlib
+import time
+import tracemalloc
+
+from benchmarks import fixtures
+from src.configs import HTML_PARSER
+from src.parser import make_soup
+
+# the queries of the extractors of every page type
+PAGES = {
+    "login": (fixtures.login_page(),
+              lambda soup: soup.find_all("li", {"class": "btnav-info", "title": "当前用户所在单位"})),
+    "course": (fixtures.course_page('https://course.ucas.ac.cn/portal/site/1'),
+               lambda soup: [soup.find('a', tag) for tag in
+                             (fixtures.TARGET_PAGE_TAG[t] for t in ('courseware', 'video', 'homework'))]),
+    "courseware": (fixtures.resource_page(
+        'https://course.ucas.ac.cn/portal/tool/1', '/group/1/',
+        [(f'https://course.ucas.ac.cn/access/content/group/1/lecture{i}.pdf', '2020-3-13 上午11:00', '1.2 MB')
+         for i in range(100)], [f'folder{i}' for i in range(10)]),
+        lambda soup: [soup.find('form'), soup.find('input', {'name': 'sakai_csrf_token'})]
+        + soup.find_all('tr')),
+    "video": (fixtures.video_page([(str(i), '2020-03-13') for i in range(50)]),
+              lambda soup: soup.find_all("div", {"class": "col"})),
+    "video_play": (fixtures.video_play_page('第一讲', 'https://course.ucas.ac.cn/video/1.mp4'),
+                   lambda soup: [soup.find("video"), soup.find("h2", {"style": "margin-left: 2em;margin-top: 10px"})]),
+    "homework": (fixtures.homework_page([(f'作业{i}', '尚未提交', '2020-3-20') for i in range(20)]),
+                 lambda soup: soup.find_all("tr")),
+}
+
+
+def available_backends():
+    backends = []
+    for backend in HTML_PARSER["backends"] + ["html.parser"]:
+        if backend in backends:
+            continue
+        try:
+            if backend != 'html.parser':
+                importlib.import_module(backend)
+            backends.append(backend)
+        except ImportError:
+            pass
+    return backends
+
+
+def measure(text, page, backend, partial, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        make_soup(text, page, backend=backend, partial=partial)
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    soup = make_soup(text, page, backend=backend, partial=partial)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return soup, elapsed, peak
+
+
+def main(args):
+    print(f"{'page':>12} {'backend':>12} {'mode':>8} {'size':>8} {'time/page':>11} {'peak mem':>10}  same")
+    for page, (text, extract) in PAGES.items():
+        expected = [str(tag) for tag in extract(make_soup(text, backend='html.parser', partial=False))]
+        for backend in available_backends():
+            for partial in (False, True):
+                soup, elapsed, peak = measure(text, page, backend, partial, args.repeat)
+                same = [str(tag) for tag in extract(soup)] == expected
+                print(f"{page:>12} {backend:>12} {'partial' if partial else 'full':>8} "
+                      f"{len(text) / 1024:6.1f}KB {elapsed * 1000:9.2f}ms {peak / 1024:8.1f}KB  {same}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20, help='times to parse every page')
+    main(parser.parse_args())
@@ -0,0 +1,138 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : bench_sync.py
+@Description: End-to-end benchmark of a whole sync against the local mock portal.
+
+The Manager logs in, lists the courses, crawls and downloads everything of
+a synthetic account in the headless mode. Every host is resolved to the
+mock portal, so no request leaves the machine.
+
+Usage:
+    python -m benchmarks.bench_sync [--courses N] [--files N] [--folders N] [--depth N]
+                                    [--file-size KB] [--videos N] [--video-size KB]
+                                    [--latency MS] [--runs N] [--mode MODE] [--accounts N]
+
+With several accounts, every account has its own download directory and
+they are synced concurrently by the AccountRunner.
+'''
+
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import resource
+import tempfile
+import time
+
+from aiohttp import web
+
+from benchmarks.mock_portal import (Account, LocalResolver, MockPortal)
+from src.accounts import AccountRunner
+from src.configs import (DATABASE_NAME, SEGMENTED_DOWNLOAD)
+from src.headless import load_config
+from src.logger import logger
+from src.manager import Manager
+from src.metrics import metrics
+from src.transport import create_session
+
+
+def headless_config(directory, mode, accounts=1):
+    config_path = os.path.join(directory, 'config.json')
+    config = {"use_cache": False, "mode": mode, "database": os.path.join(directory, DATABASE_NAME)}
+    if accounts == 1:
+        config.update(username="bench", password="bench", download_path=os.path.join(directory, 'downloads'))
+    else:
+        config["accounts"] = [{"username": f"bench{i}", "password": "bench",
+                               "download_path": os.path.join(directory, 'downloads', f'bench{i}')}
+                              for i in range(accounts)]
+    with open(config_path, 'w') as fd:
+        json.dump(config, fd)
+    return load_config(config_path)
+
+
+def peak_rss():
+    """ Peak resident set size in MB of this process. The processes of the
+    extractor pool are started by the fork server, so they are not counted.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def count_files(directory):
+    return sum(len(files) for _, _, files in os.walk(directory))
+
+
+def print_phases(report):
+    phases = {}
+    for span in report["spans"]:
+        phase = phases.setdefault(span["name"], {"count": 0, "seconds": 0.0, "max": 0.0})
+        phase["count"] += span["count"]
+        phase["seconds"] += span["seconds"]
+        phase["max"] = max(phase["max"], span["max"])
+    print(f"{'phase':>16} {'count':>8} {'total s':>10} {'mean ms':>10} {'max ms':>10}")
+    for name, phase in sorted(phases.items(), key=lambda item: -item[1]["seconds"]):
+        print(f"{name:>16} {phase['count']:8d} {phase['seconds']:10.3f} "
+              f"{phase['seconds'] / phase['count'] * 1000:10.2f} {phase['max'] * 1000:10.2f}")
+
+
+async def main(args):
+    account = Account(courses=args.courses, folders=args.folders, depth=args.depth, files=args.files,
+                      file_size=args.file_size << 10, videos=args.videos, video_size=args.video_size << 10)
+    portal = MockPortal(account, latency=args.latency / 1000)
+    runner = web.AppRunner(portal.create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    # the videos are served as mp4 files, which are downloaded in segments
+    # instead of by youtube-dl
+    SEGMENTED_DOWNLOAD["video"]["threshold"] = 0
+    logger.setLevel(logging.WARNING)
+    print(f"{args.accounts} accounts of {account.courses} courses, {account.file_count()} files and "
+          f"{account.courses * account.videos} videos, {account.total_bytes() / (1 << 20):.1f} MB, "
+          f"{args.latency} ms latency.")
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            config = headless_config(directory, args.mode, args.accounts)
+            download_path = os.path.join(directory, 'downloads')
+            # the later runs sync against the database and the files of the first one
+            for run in range(args.runs):
+                requests, bytes_sent, start = portal.requests, portal.bytes_sent, time.perf_counter()
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    if args.accounts > 1:
+                        await AccountRunner(config, LocalResolver(port)).run()
+                    else:
+                        async with create_session(resolver=LocalResolver(port)) as session:
+                            await Manager(session, config["database"], config).run()
+                elapsed = time.perf_counter() - start
+                requests, bytes_sent = portal.requests - requests, portal.bytes_sent - bytes_sent
+                files = count_files(download_path) if os.path.exists(download_path) else 0
+                print(f"Run {run + 1}: {elapsed:.2f} s, {files} files on disk, {requests} requests, "
+                      f"{requests / elapsed:.1f} requests/s, {bytes_sent / elapsed / (1 << 20):.1f} MB/s.")
+    finally:
+        await runner.cleanup()
+    print(f"Peak RSS {peak_rss():.1f} MB.")
+    print_phases(metrics.report())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--courses', type=int, default=200)
+    parser.add_argument('--folders', type=int, default=2, help='subfolders of every folder')
+    parser.add_argument('--depth', type=int, default=1, help='levels of subfolders')
+    parser.add_argument('--files', type=int, default=5, help='files of every folder')
+    parser.add_argument('--file-size', type=int, default=64, help='size of every file in KB')
+    parser.add_argument('--videos', type=int, default=0, help='videos of every course')
+    parser.add_argument('--video-size', type=int, default=1024, help='size of every video in KB')
+    parser.add_argument('--latency', type=float, default=0, help='latency of every request in ms')
+    parser.add_argument('--runs', type=int, default=1, help='syncs of the same account, '
+                        'the later ones show the cost of a sync without changes')
+    parser.add_argument('--mode', type=int, default=None,
+                        help='download objects, 1: coursewares, 2: videos, 4: homeworks, '
+                             'default 1, or 3 with videos')
+    parser.add_argument('--accounts', type=int, default=1, help='accounts synced concurrently')
+    args = parser.parse_args()
+    if args.mode is None:
+        args.mode = 3 if args.videos else 1
+    asyncio.get_event_loop().run_until_complete(main(args))
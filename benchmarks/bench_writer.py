@@ -0,0 +1,100 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : bench_writer.py
+@Description: Benchmark of writing downloaded files, 1 KiB blocking writes
+              versus buffered writes in a thread pool with adaptive chunks.
+
+Usage:
+    python -m benchmarks.bench_writer [--size MB] [--files N]
+'''
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from aiohttp import ClientSession, web
+
+from src.writer import stream_to_file
+
+
+def create_app(size):
+    payload = os.urandom(1 << 20)
+
+    async def handle(request):
+        resp = web.StreamResponse()
+        resp.content_length = size
+        await resp.prepare(request)
+        sent = 0
+        while sent < size:
+            data = payload[:min(len(payload), size - sent)]
+            await resp.write(data)
+            sent += len(data)
+        return resp
+    app = web.Application()
+    app.router.add_get('/file', handle)
+    return app
+
+
+async def blocking_write(resp, fd):
+    """ The old way: 1 KiB chunks written in the event loop. """
+    while True:
+        chunk = await resp.content.read(1 << 10)
+        if not chunk:
+            break
+        fd.write(chunk)
+
+
+async def monitor_loop_latency(samples, interval=0.001):
+    """ Record how late the event loop wakes a sleeping task up. """
+    loop = asyncio.get_event_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - start - interval)
+
+
+async def bench(name, write, url, files, size, directory):
+    samples = []
+    monitor = asyncio.create_task(monitor_loop_latency(samples))
+
+    async def download(session, i):
+        async with session.get(url) as resp:
+            with open(os.path.join(directory, f'{name}-{i}'), 'wb') as fd:
+                await write(resp, fd)
+
+    start = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*[download(session, i) for i in range(files)])
+    elapsed = time.perf_counter() - start
+    monitor.cancel()
+    samples.sort()
+    print(f"{name:>10}: {files * size / elapsed / (1 << 20):8.1f} MB/s, "
+          f"loop latency mean {statistics.mean(samples) * 1000:6.2f} ms, "
+          f"p99 {samples[int(len(samples) * 0.99)] * 1000:6.2f} ms, "
+          f"max {samples[-1] * 1000:6.2f} ms")
+
+
+async def main(args):
+    size = args.size << 20
+    runner = web.AppRunner(create_app(size))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', args.port)
+    await site.start()
+    url = f'http://127.0.0.1:{args.port}/file'
+    print(f"Downloading {args.files} files of {args.size} MB concurrently.")
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            await bench('before', blocking_write, url, args.files, size, directory)
+            await bench('after', stream_to_file, url, args.files, size, directory)
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=64, help='size of every file in MB')
+    parser.add_argument('--files', type=int, default=8, help='number of concurrent downloads')
+    parser.add_argument('--port', type=int, default=8765)
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
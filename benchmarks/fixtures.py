@@ -0,0 +1,105 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : fixtures.py
+@Description: Fixture pages shaped like the pages of the UCAS course website.
+'''
+
+from urllib import parse
+
+from src.configs import TARGET_PAGE_TAG
+
+
+def boilerplate(n=200):
+    """ Navigation, scripts and styles which surround the useful part of a page. """
+    items = ''.join(f'<li class="Mrphs-sitesNav__menuitem"><a href="/portal/site/{i}" '
+                    f'title="site {i}"><span>站点 {i}</span></a></li>' for i in range(n))
+    scripts = ''.join(f'<script type="text/javascript">var portal_{i} = {{"id": {i}}};</script>'
+                      for i in range(n // 4))
+    return f'<div id="header"><ul class="Mrphs-sitesNav">{items}</ul></div>{scripts}'
+
+
+def page(body, title='课程网站'):
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{title}</title></head>'
+            f'<body>{boilerplate()}<div id="content">{body}</div></body></html>')
+
+
+def login_page(institute='计算机科学与技术学院', name='张三'):
+    return page(f'<ul><li class="btnav-info" title="当前用户所在单位">{institute} {name}</li></ul>')
+
+
+def course_page(base_url):
+    """ The main page of a course, with the tabs of resources, videos and homeworks. """
+    tabs = ''.join(
+        f'<li><a class="Mrphs-toolsNav__menuitem--link" href="{base_url}/{m_type}" '
+        f'title="{tag["title"]}"><span>{m_type}</span></a></li>'
+        for m_type, tag in TARGET_PAGE_TAG.items() if tag)
+    return page(f'<ul class="Mrphs-toolsNav__menu">{tabs}</ul>')
+
+
+def resource_page(function_url, collection_id, files, folders, token='csrf-token'):
+    """ A folder of the resources.
+    Args:
+        function_url: String, the action of the form
+        collection_id: String, the collection id of the folder, ends with '/'
+        files: List of tuples (url, date, size)
+        folders: List of names of the subfolders
+    """
+    rows = [f'<tr><td class="attach" headers="checkboxes"><input type="checkbox" value="{collection_id}"/></td>'
+            f'<td><a href="#">{collection_id}</a></td></tr>']
+    for folder in folders:
+        rows.append(f'<tr><td class="attach" headers="checkboxes">'
+                    f'<input type="checkbox" value="{collection_id}{folder}/"/></td>'
+                    f'<td><a href="#">{folder}</a></td></tr>')
+    for url, date, size in files:
+        name = parse.unquote(url.rsplit('/', 1)[-1])
+        rows.append(f'<tr><td class="attach" headers="checkboxes">'
+                    f'<input type="checkbox" value="{collection_id}{name}"/></td>'
+                    f'<td class="title"><a href="{url}">{name}</a></td>'
+                    f'<td class="size hidden-xs">{size}</td>'
+                    f'<td class="modified hidden-sm hidden-xs">{date}</td></tr>')
+    return page(f'<form name="showForm" action="{function_url}" method="post">'
+                f'<input type="hidden" name="sakai_csrf_token" value="{token}"/>'
+                f'<table class="resourcesList">{"".join(rows)}</table></form>')
+
+
+def video_page(videos):
+    """ The list of videos, videos is a list of tuples (video_id, date). """
+    divs = ''.join(f'<div class="col"><a onclick="gotoPlay(\'{video_id}\',\'u\')"><img src="/img/{video_id}.jpg"/></a>'
+                   f'<div class="col_1">上传时间：{date}</div><div class="col_1">时长：01:30:00</div></div>'
+                   for video_id, date in videos)
+    return page(divs)
+
+
+def video_play_page(name, src):
+    return page(f'<h2 style="margin-left: 2em;margin-top: 10px">{name}</h2>'
+                f'<video controls="controls"><source src="{src}" type="video/mp4"/></video>')
+
+
+def homework_page(homeworks):
+    """ The table of homeworks, homeworks is a list of tuples (title, status, due_date). """
+    rows = ['<tr><th>作业</th><th>状态</th><th>截止日期</th></tr>']
+    for title, status, due_date in homeworks:
+        rows.append(f'<tr><td headers="title"><a href="#">{title}</a></td>'
+                    f'<td headers="status">{status}</td>'
+                    f'<td headers="dueDate"><span>{due_date}</span></td></tr>')
+    return page(f'<table>{"".join(rows)}</table>')
+
+
+def portal_page(course_website_url):
+    """ The portal of sep.ucas.ac.cn, which refreshes to the course website. """
+    return page(f'<noscript><meta http-equiv="refresh" content="0;url={course_website_url}"/></noscript>',
+                title='SEP')
+
+
+def course_portal_page(all_courses_url, user='张三'):
+    """ The home of the course website, with the tab of all the courses. """
+    return page(f'<div class="Mrphs-userNav__submenuitem--displayid">{user}</div>'
+                f'<ul><li><a class="Mrphs-toolsNav__menuitem--link" href="{all_courses_url}" '
+                f'title="我的课程 - 查看或加入站点"><span>我的课程</span></a></li></ul>')
+
+
+def all_courses_page(courses):
+    """ The list of all the courses, courses is a list of tuples (name, url). """
+    items = ''.join(f'<li><div class="fav-title"><a href="{url}" title="{name}">{name}</a></div></li>'
+                    for name, url in courses)
+    return page(f'<ul class="otherSitesCategorList favoriteSiteList">{items}</ul>')
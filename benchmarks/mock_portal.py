@@ -0,0 +1,202 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : mock_portal.py
+@Description: Local stand-in of the UCAS servers which serves a synthetic account.
+'''
+
+import asyncio
+import json
+import re
+import socket
+from urllib import parse
+
+from aiohttp import web
+from aiohttp.abc import AbstractResolver
+
+from benchmarks import fixtures
+from src.configs import (LOGIN_URL, PORTAL_URL)
+
+COURSE_HOST = 'course.ucas.ac.cn'
+DATE = '2020-3-13 上午11:00'
+
+
+class LocalResolver(AbstractResolver):
+    """ Resolve every host to the mock server, whatever the port of the url is. """
+
+    def __init__(self, port):
+        self.port = port
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        return [{'hostname': host, 'host': '127.0.0.1', 'port': self.port,
+                 'family': socket.AF_INET, 'proto': 0, 'flags': socket.AI_NUMERICHOST}]
+
+    async def close(self):
+        pass
+
+
+class Account(object):
+    """ A synthetic account whose courses have the same shape.
+
+    Every folder of the resources has `files` files and, above `depth`
+    levels, `folders` subfolders.
+    """
+
+    def __init__(self, courses=100, folders=2, depth=1, files=10, file_size=64 << 10,
+                 videos=0, video_size=1 << 20, homeworks=5):
+        self.courses = courses
+        self.folders = folders
+        self.depth = depth
+        self.files = files
+        self.file_size = file_size
+        self.videos = videos
+        self.video_size = video_size
+        self.homeworks = homeworks
+
+    def site(self, i):
+        return f'bench{i}'
+
+    def course_url(self, site):
+        return f'http://{COURSE_HOST}/portal/site/{site}'
+
+    def folder_count(self):
+        return sum(self.folders ** level for level in range(self.depth + 1))
+
+    def file_count(self):
+        return self.courses * self.folder_count() * self.files
+
+    def total_bytes(self):
+        return self.file_count() * self.file_size + self.courses * self.videos * self.video_size
+
+    def resource_page(self, site, collection_id):
+        path = collection_id[len(f'/group/{site}/'):]
+        level = path.count('/')
+        folders = [f'folder{j}' for j in range(self.folders)] if level < self.depth else []
+        size = f'{self.file_size / 1024:.0f} KB'
+        files = [(f'http://{COURSE_HOST}/access/content/group/{site}/{path}file{k}.pdf', DATE, size)
+                 for k in range(self.files)]
+        return fixtures.resource_page(f'http://{COURSE_HOST}/portal/tool/{site}', collection_id, files, folders)
+
+
+class MockPortal(object):
+    """ aiohttp application which replays the pages of the UCAS servers.
+
+    Every request waits `latency` seconds before it is answered. Files are
+    served with Range support, so the segmented downloads work as well.
+    """
+
+    def __init__(self, account, latency=0.0):
+        self.account = account
+        self.latency = latency
+        self.requests = 0
+        self.bytes_sent = 0
+        self._payload = b'\0' * (1 << 20)
+        self._pages = {}
+        login = parse.urlsplit(LOGIN_URL)
+        portal = parse.urlsplit(PORTAL_URL)
+        self._routes = [
+            ('POST', login.hostname, re.escape(login.path), self.login),
+            ('GET', 'sep.ucas.ac.cn', '/portal/login', self.login_page),
+            ('GET', 'sep.ucas.ac.cn', '/appStore', self.app_store),
+            ('GET', portal.hostname, re.escape(portal.path), self.portal),
+            ('GET', COURSE_HOST, '/portal/plogin', self.course_portal),
+            ('GET', COURSE_HOST, '/portal/site/~me/tool/all', self.all_courses),
+            ('GET', COURSE_HOST, r'/portal/site/(?P<site>[^/]+)', self.course),
+            ('GET', COURSE_HOST, r'/portal/site/(?P<site>[^/]+)/courseware', self.resources),
+            ('POST', COURSE_HOST, r'/portal/tool/(?P<site>[^/]+)', self.navigate),
+            ('GET', COURSE_HOST, r'/portal/site/(?P<site>[^/]+)/video', self.video_list),
+            ('GET', COURSE_HOST, r'/portal/site/(?P<site>[^/]+)/video/video/play', self.video_play),
+            ('GET', COURSE_HOST, r'/portal/site/(?P<site>[^/]+)/homework', self.homework),
+            ('GET', COURSE_HOST, r'/access/content/group/.+', self.file),
+            ('GET', COURSE_HOST, r'/bench/video/.+\.mp4', self.file),
+        ]
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', self.dispatch)
+        return app
+
+    async def dispatch(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        host = request.host.split(':')[0]
+        for method, route_host, pattern, handler in self._routes:
+            if method != request.method or host != route_host:
+                continue
+            match = re.fullmatch(pattern, request.path)
+            if match:
+                return await handler(request, **match.groupdict())
+        raise web.HTTPNotFound()
+
+    def html(self, text):
+        body = text.encode('utf-8')
+        self.bytes_sent += len(body)
+        return web.Response(body=body, content_type='text/html', charset='utf-8')
+
+    async def login(self, request):
+        return web.Response(text=json.dumps(
+            {'f': True, 'msg': 'http://sep.ucas.ac.cn/portal/login?ticket=bench'}))
+
+    async def login_page(self, request):
+        return self.html(fixtures.login_page())
+
+    async def app_store(self, request):
+        return self.html(fixtures.page('', title='appStore'))
+
+    async def portal(self, request):
+        return self.html(fixtures.portal_page(f'http://{COURSE_HOST}/portal/plogin?ticket=bench'))
+
+    async def course_portal(self, request):
+        return self.html(fixtures.course_portal_page(f'http://{COURSE_HOST}/portal/site/~me/tool/all'))
+
+    async def all_courses(self, request):
+        account = self.account
+        return self.html(fixtures.all_courses_page(
+            [(f'课程{i}', account.course_url(account.site(i))) for i in range(account.courses)]))
+
+    async def course(self, request, site):
+        return self.html(fixtures.course_page(self.account.course_url(site)))
+
+    async def resources(self, request, site):
+        return self.html(self.account.resource_page(site, f'/group/{site}/'))
+
+    async def navigate(self, request, site):
+        form = await request.post()
+        return self.html(self.account.resource_page(site, form['collectionId']))
+
+    async def video_list(self, request, site):
+        return self.html(fixtures.video_page(
+            [(f'{site}-{k}', '2020-03-13') for k in range(self.account.videos)]))
+
+    async def video_play(self, request, site):
+        video_id = request.query['id']
+        return self.html(fixtures.video_play_page(
+            f'视频{video_id}', f'http://{COURSE_HOST}/bench/video/{video_id}.mp4'))
+
+    async def homework(self, request, site):
+        return self.html(fixtures.homework_page(
+            [(f'作业{k}', '尚未提交' if k % 2 else '已提交', '2020-3-20') for k in range(self.account.homeworks)]))
+
+    async def file(self, request):
+        size = self.account.video_size if request.path.endswith('.mp4') else self.account.file_size
+        start, end, status = 0, size - 1, 200
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', request.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else end, size - 1)
+            status = 206
+        resp = web.StreamResponse(status=status)
+        resp.content_length = end + 1 - start
+        resp.headers['Accept-Ranges'] = 'bytes'
+        resp.headers['ETag'] = '"bench"'
+        if status == 206:
+            resp.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        await resp.prepare(request)
+        remaining = end + 1 - start
+        while remaining > 0:
+            data = self._payload[:min(len(self._payload), remaining)]
+            await resp.write(data)
+            remaining -= len(data)
+            self.bytes_sent += len(data)
+        await resp.write_eof()
+        return resp
@@ -8,20 +8,34 @@
 '''
 
 
+import argparse
 import asyncio
-from aiohttp import ClientSession
 from signal import signal, SIGINT
 from sys import exit
 from time import (sleep, ctime)
 
+from src.accounts import (AccountRunner, add_account)
 from src.manager import Manager
 from src.configs import DATABASE_NAME
+from src.headless import load_config
+from src.transport import create_session
 
-async def main():
+async def main(args):
     try:
-        async with ClientSession() as session:
-            manager = Manager(session, DATABASE_NAME)
-            await manager.run()
+        config = load_config(args.config) if args.config else None
+        database_path = config["database"] if config is not None else DATABASE_NAME
+        if args.add_account:
+            add_account(database_path)
+            return
+        if config is not None and "accounts" in config:
+            await AccountRunner(config).run(args.watch)
+            return
+        async with create_session() as session:
+            manager = Manager(session, database_path, config)
+            if args.watch:
+                await manager.watch()
+            else:
+                await manager.run()
     except Exception as e:
         print('[Exception]:', type(e), e)
         return
@@ -33,7 +47,17 @@ def handler(signal_received, frame):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Download the coursewares and videos of UCAS courses.')
+    parser.add_argument('-c', '--config', help='run without asking anything, with the config file in JSON')
+    parser.add_argument('-w', '--watch', action='store_true',
+                        help='keep running and sync the courses on schedule, needs --config')
+    parser.add_argument('--add-account', action='store_true',
+                        help='keep another account in the database, which is synced with the others '
+                             'by a config file with "accounts": "database"')
+    args = parser.parse_args()
+    if args.watch and not args.config:
+        parser.error('--watch needs --config')
     signal(SIGINT, handler)
     print(f'[{ctime()}] Press CTRL-C to exit.')
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    loop.run_until_complete(main(args))
@@ -0,0 +1,124 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : accounts.py
+@Description: Runner which syncs several accounts concurrently in one process.
+'''
+
+import asyncio
+import sqlite3
+from getpass import getpass
+
+from src.configs import SQL_CMD
+from src.extractor import shutdown_pool
+from src.headless import account_configs
+from src.logger import logger
+from src.manager import (Manager, disable_http_cache, export_metrics)
+from src.manifest import (AccountManifest, ManifestStore)
+from src.retry import policy as retry_policy
+from src.scheduler import SharedLimits
+from src.transport import (create_connector, create_session, stats as transport_stats)
+
+
+def add_account(database_path):
+    """ Ask for an account and keep it in the database, to be synced with "accounts": "database". """
+    username = input('username: ')
+    password = getpass('password: ')
+    download_path = input('Where to save coursewares: ')
+    db = sqlite3.connect(database_path)
+    try:
+        db.execute(SQL_CMD["user"]["create"])
+        db.execute(SQL_CMD["user"]["add_account"], [username, password, download_path, 'N', ''])
+        db.commit()
+    except sqlite3.IntegrityError:
+        # the account is kept already, maybe as the default one of the interactive mode
+        logger.error(f'Account {username} is kept already.')
+        return
+    finally:
+        db.close()
+    logger.info(f'Account {username} is added.')
+
+
+class AccountRunner(object):
+    """ Sync the accounts of the config concurrently.
+
+    Every account logs in with its own session, i.e. its own cookie jar
+    and page cache, and is synced by its own Manager. The sessions share
+    one connection pool, and the managers share one manifest store of the
+    database and the limits of ACCOUNTS, besides the bandwidth cap and the
+    retry policy which are shared by the whole process anyway.
+    """
+
+    def __init__(self, config, resolver=None):
+        """
+        Args:
+            config: Dictionary, the config of several accounts (see
+                    src.headless.load_config)
+            resolver: aiohttp resolver of the connection pool, None for the default one
+        """
+        self.config = config
+        self.resolver = resolver
+        self.database_path = config["database"]
+
+    def load_accounts(self, db):
+        if self.config["accounts"] != "database":
+            return self.config["accounts"]
+        accounts = account_configs(self.config, db.execute(SQL_CMD["user"]["accounts"]).fetchall())
+        if not accounts:
+            raise RuntimeError('No account is kept in the database.')
+        return accounts
+
+    async def run(self, watch=False):
+        """ Sync all the accounts once, or on schedule until interrupted if watch.
+        Returns:
+            failed: List of the usernames of the accounts which failed
+        """
+        db = sqlite3.connect(self.database_path)
+        for command in SQL_CMD.values():
+            db.execute(command["create"])
+        db.commit()
+        accounts = self.load_accounts(db)
+        store = ManifestStore(self.database_path, db)
+        limits = SharedLimits()
+        connector = create_connector(self.resolver)
+        sessions = []
+        store.start()
+        try:
+            managers = []
+            for account in accounts:
+                session = create_session(connector=connector)
+                sessions.append(session)
+                managers.append(Manager(session, self.database_path, account,
+                                        AccountManifest(store, account["username"]), limits))
+            logger.info(f'Syncing {len(managers)} accounts.')
+            results = await asyncio.gather(*[self.sync(manager, watch) for manager in managers])
+        finally:
+            for session in sessions:
+                await session.close()
+            await store.close()
+            await connector.close()
+            db.close()
+            shutdown_pool()
+            logger.info(f'Connection stats: {transport_stats.report()}')
+            logger.info(f'Retry stats: {retry_policy.stats()}')
+            export_metrics(self.database_path)
+            for session in sessions:
+                disable_http_cache(session)
+        failed = [account["username"] for account, success in zip(accounts, results) if not success]
+        if failed:
+            logger.error(f'Failed accounts: {", ".join(failed)}')
+        return failed
+
+    async def sync(self, manager, watch):
+        """ Sync one account, a failed account does not stop the others.
+        Returns:
+            tag: True if the account is synced
+        """
+        try:
+            if watch:
+                await manager.watch()
+            else:
+                await manager.run()
+            return True
+        except Exception as e:
+            logger.error(f'Account {manager.config["username"]} failed, {type(e)}, {e}')
+            return False
@@ -0,0 +1,132 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : cache.py
+@Description: On-disk cache of fetched pages revalidated by conditional GET.
+'''
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib import parse
+
+from src.configs import HTTP_CACHE
+from src.logger import logger
+
+
+class HttpCache(object):
+    """ Cache of page bodies together with their ETag and Last-Modified.
+
+    Every entry is one json file in the cache directory, whose mtime is
+    the time it was stored or revalidated last. Entries older than ttl
+    seconds are dropped, and the least recently used entries are evicted
+    when the directory grows beyond max_size bytes.
+    The methods do blocking file I/O, so coroutines call them by run(),
+    in the one thread of the cache, which also keeps size consistent.
+    """
+
+    def __init__(self, directory, ttl=HTTP_CACHE["ttl"], max_size=HTTP_CACHE["max_size"]):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # the total size of the entries, kept up to date by put()
+        self.size = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self.evict()
+
+    async def run(self, func, *args):
+        """ Run the method func of the cache in its thread. """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def close(self):
+        self._executor.shutdown()
+
+    def key(self, url, params=None):
+        if params:
+            query = params if isinstance(params, str) else parse.urlencode(sorted(params.items()))
+            url = f'{url}?{query}'
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key):
+        """ Get the entry {'body', 'etag', 'last_modified', 'stored'}, None if missing. """
+        try:
+            if time.time() - os.path.getmtime(self._path(key)) > self.ttl:
+                self.remove(key)
+                return None
+            with open(self._path(key), 'r', encoding='utf-8') as fd:
+                return json.load(fd)
+        except (OSError, ValueError):
+            return None
+
+    def validators(self, entry):
+        """ Get the headers of the conditional GET of the entry. """
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, key, body, etag, last_modified):
+        entry = {'body': body, 'etag': etag, 'last_modified': last_modified, 'stored': time.time()}
+        path = self._path(key)
+        try:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(path, 'w', encoding='utf-8') as fd:
+                json.dump(entry, fd)
+            self.size += os.path.getsize(path) - old_size
+        except OSError as e:
+            logger.error(f'{type(e)}, {e}')
+        if self.size > self.max_size:
+            self.evict()
+
+    def touch(self, key):
+        """ Mark the entry as revalidated just now. """
+        try:
+            os.utime(self._path(key))
+        except OSError as e:
+            logger.error(f'{type(e)}, {e}')
+
+    def remove(self, key):
+        try:
+            path = self._path(key)
+            size = os.path.getsize(path)
+            os.remove(path)
+            self.size -= size
+        except OSError:
+            pass
+
+    def evict(self):
+        """ Drop expired entries and the least recently used ones, by mtime,
+        until the cache is below 90% of max_size, so that not every put()
+        beyond max_size scans the directory.
+        """
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                os.remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size * 0.9:
+                break
+            os.remove(path)
+            total -= size
+        self.size = total
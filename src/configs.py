@@ -14,30 +14,55 @@ SQL_CMD = {
         "create": "",
         "lookup": "",
         "insert": "",
-        "update": ""
+        "update": "",
+        "upsert": "",
+        "load": ""
     },
     "user": {
-        "create": "CREATE TABLE USERS (USERNAME TEXT PRIMARY KEY NOT NULL, PASSWORD TEXT, STOREPATH TEXT, ISFROMUCAS "
+        "create": "CREATE TABLE IF NOT EXISTS USERS (USERNAME TEXT PRIMARY KEY NOT NULL, PASSWORD TEXT, STOREPATH TEXT, ISFROMUCAS "
                   "TEXT, STUDENTID TEXT, MODE TEXT);",
         "lookup": "SELECT * from USERS WHERE MODE = 'default'",
+        # the accounts synced together, the default one and the added ones
+        "accounts": "SELECT USERNAME, PASSWORD, STOREPATH, ISFROMUCAS, STUDENTID from USERS WHERE MODE IN ('default', "
+                    "'account')",
+        "add_account": "INSERT INTO USERS (USERNAME, PASSWORD, STOREPATH, ISFROMUCAS, STUDENTID, MODE) VALUES "
+                       "(?, ?, ?, ?, ?, 'account')",
         "insert": "INSERT INTO USERS (USERNAME, PASSWORD, STOREPATH, ISFROMUCAS, STUDENTID, MODE) VALUES (?, ?, ?, ?, "
                   "?, ?)",
         "update": "UPDATE USERS set USERNAME = ?, PASSWORD = ?, STOREPATH = ?, ISFROMUCAS = ?, STUDENTID = ? where "
                   "MODE = 'default' "
     },
     "courseware": {
-        "create": "CREATE TABLE FILES (FILENAME TEXT PRIMARY KEY NOT NULL, URL TEXT NOT NULL, UPDATE_TIME TEXT NOT "
-                  "NULL);",
+        "create": "CREATE TABLE IF NOT EXISTS FILES (FILENAME TEXT PRIMARY KEY NOT NULL, URL TEXT NOT NULL, UPDATE_TIME TEXT NOT "
+                  "NULL, HASH TEXT, SIZE INTEGER, ETAG TEXT);",
+        # the columns added to the tables of older versions
+        "migrate": ["ALTER TABLE FILES ADD COLUMN HASH TEXT", "ALTER TABLE FILES ADD COLUMN SIZE INTEGER",
+                    "ALTER TABLE FILES ADD COLUMN ETAG TEXT"],
         "lookup": "SELECT UPDATE_TIME from FILES WHERE FILENAME = ?",
-        "insert": "INSERT INTO FILES (FILENAME, URL, UPDATE_TIME) VALUES (?, ?, ?)",
-        "update": "UPDATE FILES set UPDATE_TIME = ? where FILENAME = ?"
+        "upsert": "INSERT OR REPLACE INTO FILES (FILENAME, URL, UPDATE_TIME, HASH, SIZE, ETAG) VALUES (?, ?, ?, ?, ?, ?)",
+        "load": "SELECT FILENAME, UPDATE_TIME, HASH, SIZE, ETAG from FILES"
     },
     "video": {
-        "create": "CREATE TABLE VIDEO (FILENAME TEXT PRIMARY KEY NOT NULL, URL TEXT NOT NULL, UPDATE_TIME TEXT NOT "
-                  "NULL);",
+        "create": "CREATE TABLE IF NOT EXISTS VIDEO (FILENAME TEXT PRIMARY KEY NOT NULL, URL TEXT NOT NULL, UPDATE_TIME TEXT NOT "
+                  "NULL, HASH TEXT, SIZE INTEGER, ETAG TEXT);",
+        "migrate": ["ALTER TABLE VIDEO ADD COLUMN HASH TEXT", "ALTER TABLE VIDEO ADD COLUMN SIZE INTEGER",
+                    "ALTER TABLE VIDEO ADD COLUMN ETAG TEXT"],
         "lookup": "SELECT UPDATE_TIME from VIDEO WHERE FILENAME = ?",
-        "insert": "INSERT INTO VIDEO (FILENAME, URL, UPDATE_TIME) VALUES (?, ?, ?)",
-        "update": "UPDATE VIDEO set UPDATE_TIME = ? where FILENAME = ?"
+        "upsert": "INSERT OR REPLACE INTO VIDEO (FILENAME, URL, UPDATE_TIME, HASH, SIZE, ETAG) VALUES (?, ?, ?, ?, ?, ?)",
+        "load": "SELECT FILENAME, UPDATE_TIME, HASH, SIZE, ETAG from VIDEO"
+    },
+    "video_id": {
+        "create": "CREATE TABLE IF NOT EXISTS VIDEO_IDS (VIDEO_ID TEXT PRIMARY KEY NOT NULL, TITLE TEXT NOT NULL, "
+                  "URL TEXT NOT NULL, UPLOAD_DATE TEXT NOT NULL);",
+        "upsert": "INSERT OR REPLACE INTO VIDEO_IDS (VIDEO_ID, TITLE, URL, UPLOAD_DATE) VALUES (?, ?, ?, ?)",
+        "load": "SELECT VIDEO_ID, TITLE, URL, UPLOAD_DATE from VIDEO_IDS"
+    },
+    "listing": {
+        "create": "CREATE TABLE IF NOT EXISTS LISTINGS (COURSE TEXT NOT NULL, COLLECTION_ID TEXT NOT NULL, "
+                  "FINGERPRINT TEXT NOT NULL, UPDATE_TIME REAL NOT NULL, PRIMARY KEY (COURSE, COLLECTION_ID));",
+        "upsert": "INSERT OR REPLACE INTO LISTINGS (COURSE, COLLECTION_ID, FINGERPRINT, UPDATE_TIME) "
+                  "VALUES (?, ?, ?, ?)",
+        "load": "SELECT COURSE, COLLECTION_ID, FINGERPRINT, UPDATE_TIME from LISTINGS"
     }
 }
 
@@ -47,6 +72,13 @@ HTTP_HDRS = {
         'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_4) AppleWebKit/537.36 (KHTML, like Gecko) '
                       'Chrome/80.0.3987.122 Safari/537.36 Edg/80.0.361.62 '
     },
+    # files are downloaded unencoded, so that their lengths and Range requests
+    # count the bytes which are written into the files
+    "download": {
+        'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_4) AppleWebKit/537.36 (KHTML, like Gecko) '
+                      'Chrome/80.0.3987.122 Safari/537.36 Edg/80.0.361.62 ',
+        'Accept-Encoding': 'identity'
+    },
     "post": {
         'connection': 'keep-alive',
         'content-type': 'application/x-www-form-urlencoded; charset=UTF-8',
@@ -77,3 +109,242 @@ TARGET_PAGE_TAG = {
 }
 
 LOGIN_URL = 'http://onestop.ucas.ac.cn/Ajax/Login/0'
+
+PORTAL_URL = 'http://sep.ucas.ac.cn/portal/site/16/801'
+
+# Concurrency limits of the course crawler.
+# "global" bounds how many courses are discovered at the same time,
+# "per_host" bounds how many requests are in flight against one host,
+# "folder_fanout" bounds how many sibling folders of one course are unfolded at once,
+# "video_resolve" bounds how many play pages of one course are fetched at once.
+CRAWL_LIMITS = {
+    "global": 4,
+    "folder_fanout": 4,
+    "video_resolve": 4,
+    "per_host": {
+        "sep.ucas.ac.cn": 4,
+        "course.ucas.ac.cn": 8
+    },
+    "default_per_host": 4
+}
+
+# Limits of the download scheduler.
+# "queue_size" bounds how many discovered downloaders wait in the queue,
+# "workers" is the number of download workers of each manager,
+# "per_host" bounds how many files are downloaded from one host at once.
+DOWNLOAD_LIMITS = {
+    "queue_size": 64,
+    "workers": {
+        "courseware": 8,
+        "video": 4
+    },
+    "per_host": {
+        "course.ucas.ac.cn": 6
+    },
+    "default_per_host": 4
+}
+
+# Files which are larger than "threshold" bytes are downloaded in "segments"
+# concurrent Range requests, each segment is at least "min_segment_size" bytes.
+# The progress of the segments is saved into the .part.json file every
+# "checkpoint_interval" seconds, to resume the unfinished ranges.
+SEGMENTED_DOWNLOAD = {
+    "courseware": {
+        "threshold": 16 << 20,
+        "segments": 4
+    },
+    "video": {
+        "threshold": 32 << 20,
+        "segments": 8
+    },
+    "min_segment_size": 4 << 20,
+    "checkpoint_interval": 5
+}
+
+# Buffers of streaming downloads into files.
+# Chunks are read with an adaptive size between "min_chunk" and "max_chunk",
+# aiming at one read per "read_interval" seconds, and written into the file
+# in a thread pool once "buffer_size" bytes are batched.
+STREAM_IO = {
+    "min_chunk": 16 << 10,
+    "max_chunk": 1 << 20,
+    "read_interval": 0.05,
+    "buffer_size": 4 << 20
+}
+
+# Records of downloaded files are written in batches of at most "batch_size"
+# rows, gathered for "flush_interval" seconds.
+MANIFEST = {
+    "batch_size": 256,
+    "flush_interval": 0.5
+}
+
+# On-disk cache of fetched pages, placed next to the database.
+# Entries are dropped after "ttl" seconds or when the cache exceeds "max_size" bytes.
+HTTP_CACHE = {
+    "directory": ".http_cache",
+    "ttl": 7 * 24 * 3600,
+    "max_size": 64 << 20
+}
+
+# Backends of BeautifulSoup in the order of preference, the first installed one is used.
+# If "partial" is True, only the elements which the page needs are parsed.
+# Pages are parsed in a pool of "processes" processes (None for the number of CPUs),
+# or in the event loop if it is 0.
+HTML_PARSER = {
+    "backends": ["lxml", "html.parser"],
+    "partial": True,
+    "processes": None
+}
+
+# youtube-dl processes for downloading videos.
+# At most "processes" of them run at the same time, and a failed one is
+# retried "retries" times after "retry_delay" seconds (growing linearly).
+YOUTUBE_DL = {
+    "command": "youtube-dl",
+    "processes": 3,
+    "retries": 2,
+    "retry_delay": 5
+}
+
+# How the coursewares are discovered: "html" scrapes the resource pages folder
+# by folder, "rest" lists the whole site in one request to the Sakai content API
+# and falls back to "html" if the API is unavailable.
+# Note that the API reports dates as yyyyMMddHHmmssSSS instead of the dates shown
+# in the resource pages, so switching the backend marks every file as updated once.
+COURSEWARE_BACKEND = "html"
+
+SAKAI_CONTENT_API = '{base}/direct/content/site/{site_id}.json'
+
+# Cookies of the logged in session, encrypted and saved next to the database.
+# They are dropped after "max_age" seconds. Encryption needs the `cryptography`
+# package of requirements.txt, without it the session is not saved and a warning is logged.
+SESSION_STORE = {
+    "file": "session.bin",
+    "max_age": 7 * 24 * 3600,
+    "iterations": 200000
+}
+
+# The connection pool shared by all the requests.
+# "limit" bounds all the connections, "limit_per_host" the connections to one host,
+# DNS results are cached for "ttl_dns_cache" seconds, and idle connections are kept
+# alive for "keepalive_timeout" seconds. "verify_ssl" is off, as fetch() always did.
+TRANSPORT = {
+    "limit": 64,
+    "limit_per_host": 16,
+    "ttl_dns_cache": 600,
+    "keepalive_timeout": 60,
+    "verify_ssl": False
+}
+
+# Timeout profiles in seconds, see aiohttp.ClientTimeout.
+# "page" is for pages and api requests, "transfer" for downloading files,
+# whose total time is unbounded as long as data keeps coming.
+TIMEOUTS = {
+    "login": {"total": 30, "connect": 10, "sock_read": 20},
+    "page": {"total": 30, "connect": 10, "sock_read": 10},
+    "transfer": {"total": None, "connect": 10, "sock_read": 30}
+}
+
+# Retry policy of the requests and downloads.
+# A failed attempt is retried after a random delay in [0, min(max_delay, base_delay * 2^n)),
+# and all the retries of a run may not exceed "budget_min" + "budget_ratio" of the requests.
+# A host is paused for "cooldown" seconds after "failure_threshold" consecutive failures.
+RETRY = {
+    "attempts": 4,
+    "base_delay": 1,
+    "max_delay": 30,
+    "budget_min": 20,
+    "budget_ratio": 0.2,
+    "breaker": {
+        "failure_threshold": 5,
+        "cooldown": 30
+    }
+}
+
+# Global bandwidth cap of all the downloads in bytes per second, None for no cap.
+# Up to "burst" bytes may be received at once after an idle period.
+BANDWIDTH = {
+    "rate": None,
+    "burst": 1 << 20
+}
+
+# AIMD controller of the number of active downloads, which is at most the "workers"
+# of DOWNLOAD_LIMITS. Every "interval" seconds the limit grows by "increase" if the
+# downloads are saturated and healthy, and is multiplied by "decrease" if more than
+# "error_rate" of the requests fail, or the latency exceeds "latency_factor" times
+# the lowest latency observed.
+ADAPTIVE_CONCURRENCY = {
+    "enabled": True,
+    "initial": 2,
+    "min": 1,
+    "interval": 2.0,
+    "increase": 1,
+    "decrease": 0.5,
+    "error_rate": 0.1,
+    "latency_factor": 2.0
+}
+
+# Run report of the timed phases and the counters, written next to the database.
+# "json" is the report of the last run and "prometheus" the text file for the
+# node exporter textfile collector, None to skip either of them.
+METRICS = {
+    "json": "run_report.json",
+    "prometheus": "ucas_autodownload.prom",
+    "prefix": "ucas_autodownload"
+}
+
+# Schedule of the watch mode, in seconds.
+# A course is synced every "interval" seconds, or the interval given to it by name in
+# "courses". The interval of a course without changes is multiplied by "backoff" after
+# every sync, up to "max_interval", and is reset once the course changes again.
+# The course list is fetched again every "course_list_interval" seconds.
+# If the session cannot be probed or renewed, or the course list cannot be fetched,
+# e.g. during a network outage, it is tried again after "retry_delay" seconds, which
+# is multiplied by "backoff" after every failure in a row, up to "max_interval".
+WATCH = {
+    "interval": 3600,
+    "max_interval": 24 * 3600,
+    "backoff": 2,
+    "retry_delay": 60,
+    "course_list_interval": 6 * 3600,
+    "courses": {}
+}
+
+# Incremental crawl of the coursewares. A folder whose listing has the same fingerprint
+# as in the last complete sync of its course is skipped with its subfolders, so is a
+# course whose top folder is unchanged. Fingerprints older than "max_age" seconds are
+# ignored, so that every course is walked through completely now and then.
+CRAWL_INDEX = {
+    "enabled": True,
+    "max_age": 7 * 24 * 3600
+}
+
+# Deduplication of the downloaded files by the sha256 of their content.
+# A file with the same content as a recorded one is replaced by a "hardlink" or a
+# "reflink" (copy-on-write clone, falls back to a hardlink), None to keep the copies.
+# With "precheck", the ETag and the size of a file are checked by a Range request
+# before downloading, and a file matching a recorded one is linked without downloading.
+DEDUP = {
+    "link": "hardlink",
+    "precheck": False
+}
+
+# Accounts synced together by one process (see src.accounts). They share the connection
+# pool, the bandwidth cap and the manifest database, and their crawls and downloads run
+# within these limits together, which replace the "global" and "per_host" limits of
+# CRAWL_LIMITS and the "workers" limit (as the total) and "per_host" limits of DOWNLOAD_LIMITS.
+ACCOUNTS = {
+    "crawl_global": 8,
+    "crawl_per_host": {
+        "sep.ucas.ac.cn": 8,
+        "course.ucas.ac.cn": 16
+    },
+    "download_workers": {
+        "courseware": 16,
+        "video": 8
+    },
+    "download_per_host": {
+        "course.ucas.ac.cn": 12
+    }
+}
@@ -0,0 +1,68 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : dedup.py
+@Description: Content hashes and links of the files with the same content.
+'''
+
+import hashlib
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl of Linux which clones a file on copy-on-write file systems, e.g. btrfs and xfs
+FICLONE = 0x40049409
+
+
+def hash_file(path, digest=None, chunk_size=1 << 20):
+    """ Update the digest (a new sha256 if None) with the content of the file.
+    Returns:
+        digest: the updated hashlib object
+    """
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest
+
+
+def reflink(source, target):
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def link_file(source, path, mode, size):
+    """ Make path a link to source, which should be a file of size bytes.
+
+    The link is created aside and moved into place, so path is never
+    missing. A reflink falls back to a hardlink if the file system can not
+    clone files.
+    Args:
+        mode: String, "hardlink" or "reflink"
+    Returns:
+        tag: True if path is (or already was) a link to source
+    """
+    try:
+        if os.path.getsize(source) != size:
+            return False
+        if os.path.exists(path) and os.path.samefile(source, path):
+            return True
+        temp = path + '.link'
+        if os.path.exists(temp):
+            os.remove(temp)
+        if mode == "reflink" and fcntl is not None:
+            try:
+                reflink(source, temp)
+                os.replace(temp, path)
+                return True
+            except OSError:
+                if os.path.exists(temp):
+                    os.remove(temp)
+        os.link(source, temp)
+        os.replace(temp, path)
+        return True
+    except OSError:
+        # e.g. the files are on different devices
+        return False
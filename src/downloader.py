@@ -8,40 +8,96 @@
 '''
 
 import asyncio
+import hashlib
+import json
 import os
-import sys
-from src.configs import (SQL_CMD, HTTP_HDRS)
+import re
+from urllib import parse
+
+from src.configs import (BANDWIDTH, DEDUP, HTTP_HDRS, SEGMENTED_DOWNLOAD, YOUTUBE_DL)
+from src.dedup import (hash_file, link_file)
 from src.logger import logger
+from src.metrics import metrics
+from src.process import YoutubeDlProgress
+from src.retry import (TransientError, policy as retry_policy)
+from src.transport import get_timeout
+from src.segmented import (SegmentedDownloader, probe_range, should_segment)
+from src.writer import stream_to_file
 
 
 class BasicDownloader(object):
-    def __init__(self, manager, name, url, path, date, db, d_type="basic"):
-        self.sql = SQL_CMD[d_type]
+    def __init__(self, manager, name, url, path, date, manifest, d_type="basic", size=None):
+        self.d_type = d_type
         self.manager = manager
         self.course = name
         self.path = path
         self.url = url
         self.date = date
+        self.size = size
         self.record_date = ""
-        self.db = db
-        try:
-            self.cursor = self.db.cursor()
-        except Exception as e:
-            logger.error(f'{type(e)}, {e}')
-            sys.exit(1)
+        self.status = None
+        self.part_path = self.path + '.part'
+        self.part_info_path = self.part_path + '.json'
+        self.manifest = manifest
+        # the sha256 of the content and the ETag of the downloaded file
+        self.digest = None
+        self.etag = None
 
     def add_message(self, mode, msg):
-        self.manager.add_report_message(mode, msg)
+        self.manager.add_report_message(mode, msg, self.course)
+
+    def record(self):
+        """ Record the file in the manifest, after it is downloaded. """
+        self.manifest.record(self.d_type, self.path, self.url, self.date,
+                             self.digest, os.path.getsize(self.path), self.etag)
 
-    def update(self):
-        self.cursor.execute(self.sql['update'],
-                            [self.date, self.path])
-        self.db.commit()
+    async def link_content(self, source, size):
+        """ Replace the file by a link to source in the executor. """
+        loop = asyncio.get_event_loop()
+        if not await loop.run_in_executor(None, link_file, source, self.path, DEDUP["link"], size):
+            return False
+        if source != self.path:
+            logger.info(f"{self.course}/{os.path.basename(self.path)} is the same as {source}, linked.")
+            metrics.count("deduplicated_files", type=self.d_type)
+            metrics.count("deduplicated_bytes", size, type=self.d_type)
+        return True
 
-    def insert(self):
-        self.cursor.execute(self.sql['insert'],
-                            [self.path, self.url, self.date])
-        self.db.commit()
+    async def deduplicate(self):
+        """ Hash the downloaded file unless it is hashed while streaming, and
+        link it to a recorded file with the same content if any.
+        """
+        loop = asyncio.get_event_loop()
+        if self.digest is None:
+            self.digest = (await loop.run_in_executor(None, hash_file, self.path)).hexdigest()
+        if not DEDUP["link"]:
+            return
+        size = os.path.getsize(self.path)
+        for source in self.manifest.lookup_content(self.digest, size):
+            if source != self.path and await self.link_content(source, size):
+                return
+
+    async def precheck(self, session):
+        """ Link the file to a recorded file with the same ETag and size,
+        without downloading it. This also catches a file whose date is
+        changed but whose content is not.
+        Returns:
+            tag: True if linked
+        """
+        if not (DEDUP["precheck"] and DEDUP["link"]):
+            return False
+        try:
+            probe = await probe_range(session, self.url)
+        except Exception as e:
+            logger.error(f'{type(e)}, {e}')
+            return False
+        if probe is None or probe[2] is None:
+            return False
+        length, _, etag = probe
+        known = self.manifest.lookup_etag(etag, length)
+        if known is None or not await self.link_content(known[0], length):
+            return False
+        self.digest, self.etag = known[1], etag
+        return True
 
     def need_update(self):
         tag = True
@@ -50,31 +106,122 @@ class BasicDownloader(object):
         return tag
 
     def is_file_in_datebase(self):
-        tag = True
+        self.record_date = self.manifest.lookup(self.d_type, self.path)
+        return self.record_date is not None
+
+    def check_status(self):
+        """ Check the status of the file, which is looked up only once.
+        Returns:
+            status: 'new' if file not in db,
+                    'update' if file in db but need to update,
+                    '' otherwise
+        """
+        if self.status is None:
+            if not self.is_file_in_datebase():
+                self.status = 'new'
+            elif self.need_update():
+                self.status = 'update'
+            else:
+                self.status = ''
+        return self.status
+
+    def priority(self, course_rank):
+        """ Priority in the download queue, the smaller the earlier.
+        New files go before updates, small files before large ones,
+        and recent courses (with smaller rank) first.
+        """
+        size = self.size if self.size is not None else float('inf')
+        return (0 if self.check_status() == 'new' else 1, size, course_rank)
+
+    def load_part_info(self):
+        """ Load the information of the partially downloaded file.
+        Returns:
+            offset: Integer, the number of bytes already downloaded
+            part_info: Dictionary, with keys url, date, etag, last_modified, length,
+                       or url, date, length, validator, segments of a segmented download
+        """
         try:
-            self.record_date = self.cursor.execute(
-                self.sql['lookup'], [self.path]).fetchone()[0]
-        except:
-            # logger.error(f'{type(e)}, {e}')
-            tag = False
-        return tag
+            with open(self.part_info_path, 'r') as fd:
+                part_info = json.load(fd)
+            offset = os.path.getsize(self.part_path)
+        except (OSError, ValueError):
+            return 0, {}
+        # the file on the server has been changed since the last run
+        if part_info.get('url') != self.url or part_info.get('date') != self.date:
+            return 0, {}
+        return offset, part_info
+
+    def save_segments(self, length, validator, segments):
+        """ Save the progress of the segmented download atomically. """
+        part_info = {
+            'url': self.url,
+            'date': self.date,
+            'length': length,
+            'validator': validator,
+            'segments': segments
+        }
+        with open(self.part_info_path + '.tmp', 'w') as fd:
+            json.dump(part_info, fd)
+        os.replace(self.part_info_path + '.tmp', self.part_info_path)
+
+    def finish_part(self):
+        """ Move the completed file into place atomically. """
+        os.replace(self.part_path, self.path)
+        if os.path.exists(self.part_info_path):
+            os.remove(self.part_info_path)
+
+    async def download_segmented(self, session):
+        """ Download the file in concurrent Range segments if it is large enough.
+
+        The unfinished segments of an interrupted segmented download are
+        resumed if the file on the server has the same length and validator.
+        Returns:
+            tag: True if downloaded, False if the server lacks Range support
+                 or the file is too small, then it should be downloaded
+                 in a single stream.
+        """
+        probe = await probe_range(session, self.url)
+        if probe is None:
+            return False
+        length, validator, etag = probe
+        if not should_segment(length, self.d_type):
+            return False
+        self.digest, self.etag = None, etag
+        _, part_info = self.load_part_info()
+        progress = part_info.get('segments')
+        if not (progress and validator and part_info.get('length') == length
+                and part_info.get('validator') == validator):
+            progress = None
+        downloader = SegmentedDownloader(
+            session, self.url, self.part_path, length, validator,
+            segments=SEGMENTED_DOWNLOAD[self.d_type]["segments"], progress=progress,
+            save=lambda segments: self.save_segments(length, validator, segments))
+        if downloader.resumed:
+            logger.info(
+                f"Resuming {self.course}/{os.path.basename(self.path)} in segments...")
+        else:
+            logger.info(
+                f"Downloading {self.course}/{os.path.basename(self.path)} in segments...")
+        await downloader.run()
+        self.finish_part()
+        return True
 
     def need_download(self):
         """ Download conditions: 
             1. file not in db
             2. file in db but need to update
+        The file is recorded by self.record() after it is downloaded.
         """
         tag = True
-        if not self.is_file_in_datebase():
-            # print(f'{self.path} does not exist and insert it into database.')
+        status = self.check_status()
+        if status == 'new':
+            # print(f'{self.path} does not exist.')
             self.add_message(
                 'new', f"{self.course}/{os.path.basename(self.path)}")
-            self.insert()
-        elif self.need_update():
+        elif status == 'update':
             self.add_message(
                 'update', f"{self.course}/{os.path.basename(self.path)}")
             # print(f'{self.path} already exists but need to be updated.')
-            self.update()
         else:
             # print(f'{self.path} already exists and does not need to be updated.')
             tag = False
@@ -82,54 +229,158 @@ class BasicDownloader(object):
 
 
 class CoursewareDownloader(BasicDownloader):
-    def __init__(self, manager, name, url, path, date, db):
+    def __init__(self, manager, name, url, path, date, manifest, size=None):
         super(CoursewareDownloader, self).__init__(
-            manager, name, url, path, date, db, d_type="courseware")
-        self.chunk_size = (1 << 10)
+            manager, name, url, path, date, manifest, d_type="courseware", size=size)
+
+    def save_part_info(self, resp, length):
+        part_info = {
+            'url': self.url,
+            'date': self.date,
+            'etag': resp.headers.get('ETag'),
+            'last_modified': resp.headers.get('Last-Modified'),
+            'length': length
+        }
+        with open(self.part_info_path, 'w') as fd:
+            json.dump(part_info, fd)
 
-    def create_task(self, session):
-        return asyncio.create_task(self.run(session))
+    async def download(self, session):
+        """ Download the file into the .part file, resuming if possible.
+
+        The partially downloaded file is resumed by a Range request, which
+        is validated by If-Range with the ETag (or Last-Modified) recorded
+        before. If the server sends the whole file back, it is downloaded
+        from byte 0 again.
+        """
+        self.digest = None
+        offset, part_info = self.load_part_info()
+        segmented = 'segments' in part_info
+        if not segmented and offset and offset == part_info.get('length'):
+            self.etag = part_info.get('etag')
+            self.finish_part()
+            return
+        # large files (or files of unknown size) which are not partially
+        # downloaded in a single stream may be downloaded in segments
+        if segmented or (not offset and (self.size is None or should_segment(self.size, self.d_type))):
+            if await self.download_segmented(session):
+                return
+            offset, part_info = 0, {}
+        headers = dict(HTTP_HDRS['download'])
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            validator = part_info.get('etag') or part_info.get('last_modified')
+            if validator:
+                headers['If-Range'] = validator
+        async with session.get(self.url, headers=headers, timeout=get_timeout("transfer")) as resp:
+            resp.raise_for_status()
+            content_range = re.match(r'bytes (\d+)-\d+/(\d+|\*)',
+                                     resp.headers.get('Content-Range', ''))
+            # a server may encode the file anyway, then the lengths and the
+            # ranges count the encoded bytes instead of the written ones
+            encoded = resp.headers.get('Content-Encoding', 'identity') != 'identity'
+            if offset and resp.status == 206 and content_range and not encoded \
+                    and int(content_range.group(1)) == offset:
+                length = content_range.group(2)
+                length = int(length) if length.isdigit() else None
+                mode = 'ab'
+                logger.info(
+                    f"Resuming {self.course}/{os.path.basename(self.path)} from {offset} bytes...")
+            else:
+                length = resp.content_length if not encoded else None
+                mode = 'wb'
+            self.save_part_info(resp, length)
+            self.etag = resp.headers.get('ETag')
+            digest = hashlib.sha256()
+            if mode == 'ab':
+                loop = asyncio.get_event_loop()
+                digest = await loop.run_in_executor(None, hash_file, self.part_path, digest)
+            with open(self.part_path, mode) as fd:
+                await stream_to_file(resp, fd, digest=digest)
+        size = os.path.getsize(self.part_path)
+        if length is not None and size != length:
+            raise TransientError(f'Incomplete download, {size} of {length} bytes received.')
+        self.digest = digest.hexdigest()
+        self.finish_part()
 
     async def run(self, session):
-        """ Run the main downloading task. """
+        """ Run the main downloading task.
+        Returns:
+            tag: False if the download failed
+        """
         if not self.need_download():
-            return
+            return True
         try:
+            if await self.precheck(session):
+                self.record()
+                metrics.count("files", type=self.d_type, status="linked")
+                return True
             logger.info(
                 f"Downloading {self.course}/{os.path.basename(self.path)}...")
-            async with session.get(self.url, headers=HTTP_HDRS['normal'], timeout=20) as resp:
-                with open(self.path, 'wb') as fd:
-                    while True:
-                        chunk = await resp.content.read(self.chunk_size)
-                        if not chunk:
-                            break
-                        fd.write(chunk)
+            # a retried download resumes from the .part file
+            with metrics.span("download", type=self.d_type):
+                await retry_policy.call(self.url, lambda: self.download(session))
+            await self.deduplicate()
+            self.record()
+            metrics.count("files", type=self.d_type, status=self.status)
+            return True
         except Exception as e:
+            metrics.count("files", type=self.d_type, status="error")
             self.add_message(
                 'error', f"Please manually check {self.course}/{os.path.basename(self.path)}.")
             logger.error(f'{type(e)}, {e}')
+            return False
 
 
 class VideoDownloader(BasicDownloader):
-    def __init__(self, manager, name, url, path, date, db):
+    def __init__(self, manager, name, url, path, date, manifest):
         super(VideoDownloader, self).__init__(
-            manager, name, url, path, date, db, d_type="video")
+            manager, name, url, path, date, manifest, d_type="video")
 
-    def create_task(self):
-        return asyncio.create_task(self.run())
+    async def run_youtube_dl(self):
+        """ Download the video by youtube-dl in the process pool of the manager.
 
-    async def run(self):
+        A failed process is retried, except that youtube-dl is not found or
+        exits with 2, which means wrong options.
+        """
+        args = [YOUTUBE_DL["command"], "--newline", "-o", self.path, self.url]
+        if BANDWIDTH["rate"]:
+            # youtube-dl is out of the token bucket, so every process gets its share
+            args[1:1] = ["--limit-rate", str(max(1, BANDWIDTH["rate"] // YOUTUBE_DL["processes"]))]
+        progress = YoutubeDlProgress()
+        for attempt in range(YOUTUBE_DL["retries"] + 1):
+            returncode, output = await self.manager.process_pool.run(args, progress.feed)
+            if returncode == 0:
+                logger.info(
+                    f"Downloaded {self.course}/{os.path.basename(self.path)}, "
+                    f"{progress.total_bytes / (1 << 20):.1f} MiB at {progress.average_rate / (1 << 20):.2f} MiB/s.")
+                return
+            if returncode == 2 or attempt == YOUTUBE_DL["retries"]:
+                break
+            logger.info(
+                f"youtube-dl exited with {returncode}, retrying {self.course}/{os.path.basename(self.path)}...")
+            await asyncio.sleep(YOUTUBE_DL["retry_delay"] * (attempt + 1))
+        raise RuntimeError(f'youtube-dl exited with {returncode}, {output[-1] if output else ""}')
+
+    async def run(self, session):
         if not self.need_download():
-            return
+            return True
         try:
-            cmd = f"youtube-dl -o {self.path} {self.url}"
-            # cmd = f"echo 'youtube-dl -o {self.path}.mp4 {self.url}'"
-            proc = await asyncio.create_subprocess_shell(
-                cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE)
-            _, __ = await proc.communicate()
+            is_mp4 = parse.urlsplit(self.url).path.endswith('.mp4')
+            if is_mp4 and await self.precheck(session):
+                self.record()
+                metrics.count("files", type=self.d_type, status="linked")
+                return True
+            with metrics.span("download", type=self.d_type):
+                # direct mp4 files are downloaded in segments if possible
+                if not (is_mp4 and await retry_policy.call(self.url, lambda: self.download_segmented(session))):
+                    await self.run_youtube_dl()
+            await self.deduplicate()
+            self.record()
+            metrics.count("files", type=self.d_type, status=self.status)
+            return True
         except Exception as e:
+            metrics.count("files", type=self.d_type, status="error")
             self.add_message(
                 'error', f"Please manually check {self.course}/{os.path.basename(self.path)}.")
             logger.error(f'{type(e)}, {e}')
+            return False
@@ -0,0 +1,202 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : extractor.py
+@Description: Pure functions extracting records from the html of pages,
+              which are run in a process pool.
+'''
+
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from urllib import parse
+
+from src.configs import (HTML_PARSER, TARGET_PAGE_TAG)
+from src.metrics import metrics
+from src.parser import make_soup
+
+_pool = None
+
+
+async def extract(func, *args):
+    """ Run the extractor func in the process pool and get its records.
+
+    If HTML_PARSER["processes"] is 0, func is run in the event loop.
+    The workers are not forked from this process, which runs the threads of
+    the writers and the manifest by then, but started by a fork server (or
+    spawned where there is none), so they do not inherit locks held by them.
+    """
+    global _pool
+    with metrics.span("parse", extractor=func.__name__):
+        if HTML_PARSER["processes"] == 0:
+            return func(*args)
+        if _pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            _pool = ProcessPoolExecutor(HTML_PARSER["processes"], mp_context=multiprocessing.get_context(
+                "forkserver" if "forkserver" in methods else "spawn"))
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(_pool, func, *args)
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def parse_size(text):
+    """ Parse the size shown in the resource page, e.g. '1.2 MB', into bytes.
+    Returns None if the text is not a size, e.g. '3 items' of a folder.
+    """
+    match = re.match(r'^\s*([\d.]+)\s*([KMGT]?B)\s*$', text, re.I)
+    if not match:
+        return None
+    units = {'B': 0, 'KB': 1, 'MB': 2, 'GB': 3, 'TB': 4}
+    return int(float(match.group(1)) * (1 << (10 * units[match.group(2).upper()])))
+
+
+def extract_target_url(text, m_type):
+    """ Get the url of the target page from the course main page, None if not found. """
+    tab = make_soup(text, "course").find('a', TARGET_PAGE_TAG[m_type])
+    return tab.get("href") if tab is not None else None
+
+
+def extract_resource_page(text, parent_dir):
+    """ Get the information of a folder from its resource page.
+    Args:
+        text: String, the html of the resource page
+        parent_dir: String, the path of the folder
+    Returns:
+        page: Dictionary {
+                "files": list of {"subDir", "url", "fileName", "date", "size"},
+                "subdirs": list of tuples (collection_id, folder_name),
+                "collection_id": the collection id of the folder shown,
+                "function_url": the option url for unfolding subfolders,
+                "sakai_csrf_token": param of the post packets,
+                "fingerprint": hash of the rows of the listing
+              }
+    """
+    soup = make_soup(text, "courseware")
+    files = []
+    rows = soup.find_all("tr")
+    for row in rows:
+        link = row.find("a").get('href')
+        if link == '#':
+            continue
+        date = row.find(
+            "td", {"class": "modified hidden-sm hidden-xs"}).get_text().strip()
+        size = row.find("td", class_="size")
+        files.append({
+            "subDir": parent_dir,
+            "url": link,
+            "fileName": parse.unquote(os.path.basename(link)),
+            "date": date,
+            "size": parse_size(size.get_text()) if size is not None else None
+        })
+    subdirs = []
+    collection_id = None
+    checkboxes = soup.find_all('td', {'class': 'attach', 'headers': 'checkboxes'})
+    # the first one is the current folder itself
+    if checkboxes and checkboxes[0].input is not None:
+        collection_id = checkboxes[0].input.get('value')
+    for checkbox in checkboxes[1:]:
+        sub_collection_id = checkbox.input.get('value')
+        if sub_collection_id[-1] != '/':
+            continue
+        folder_name = os.path.join(parent_dir, sub_collection_id.split("/")[-2])
+        subdirs.append((sub_collection_id, folder_name))
+    form = soup.find('form')
+    token = soup.find('input', {'name': 'sakai_csrf_token'})
+    return {
+        "files": files,
+        "subdirs": subdirs,
+        "collection_id": collection_id,
+        "function_url": form.get('action') if form is not None else None,
+        "sakai_csrf_token": token.get('value') if token is not None else None,
+        "fingerprint": listing_fingerprint(rows)
+    }
+
+
+def listing_fingerprint(rows):
+    """ Hash the rows of a folder listing, i.e. the names, links, sizes
+    (item counts of the subfolders) and modified dates.
+    """
+    digest = hashlib.sha1()
+    for row in rows:
+        links = [a.get('href', '') for a in row.find_all('a')]
+        values = [i.get('value', '') for i in row.find_all('input')]
+        digest.update('\x1f'.join([row.get_text('\x1e', strip=True)] + links + values).encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def extract_site_contents(text, site_id):
+    """ Get the information of all the files of a site from the Sakai content API.
+    Args:
+        text: String, the json of /direct/content/site/<site_id>.json
+        site_id: String, the id of the site
+    Returns:
+        files: List of {"subDir", "url", "fileName", "date", "size"},
+               the same as the "files" of extract_resource_page
+    """
+    root = f'/content/group/{site_id}/'
+    files = []
+    for item in json.loads(text)["content_collection"]:
+        if item.get("type") == "collection":
+            continue
+        container = item.get("container", root)
+        sub_dir = container[len(root):] if container.startswith(root) else ''
+        files.append({
+            "subDir": os.path.join(*sub_dir.strip('/').split('/')) if sub_dir.strip('/') else '',
+            "url": item["url"],
+            "fileName": parse.unquote(os.path.basename(item["url"])),
+            "date": str(item.get("modifiedDate", "")),
+            "size": item.get("size")
+        })
+    return files
+
+
+def extract_videos(text):
+    """ Get the list of tuples (video_id, date) from the video page. """
+    infos = []
+    video_divs = make_soup(text, "video").find_all("div", {"class": "col"})
+    for div in video_divs:
+        video_id = div.find("a").get('onclick').strip(
+            "gotoPlay('").split(',')[0].strip("'")
+        date = list(filter(lambda x: "上传时间" in x.get_text(),
+                           div.find_all("div", {"class": "col_1"})))
+        limit = list(filter(lambda x: "视频预计" in x.get_text(),
+                            div.find_all("div", {"class": "col_1"})))
+        if limit != []:
+            continue
+        try:
+            date = date[0].get_text().strip("上传时间：")
+        except IndexError:
+            date = "Null"
+        infos.append((video_id, date))
+    return infos
+
+
+def extract_video_play(text):
+    """ Get the tuple (name, url) of the video from its play page. """
+    soup = make_soup(text, "video_play")
+    url = soup.find("video").find("source").get("src")
+    name = soup.find(
+        "h2", {"style": "margin-left: 2em;margin-top: 10px"}).get_text()
+    return name, url
+
+
+def extract_unsubmitted_homeworks(text):
+    """ Get the list of tuples (name, due_date) of homeworks not submitted yet. """
+    homeworks = []
+    for homework in make_soup(text, "homework").find_all("tr")[1:]:
+        status = homework.find("td", {"headers": "status"}).get_text().strip()
+        if status == "尚未提交":
+            name = homework.find("td", {"headers": "title"}).find("a").get_text()
+            due_date = homework.find("td", {"headers": "dueDate"}).find("span").get_text()
+            homeworks.append((name, due_date))
+    return homeworks
@@ -0,0 +1,135 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : headless.py
+@Description: Config file of the headless mode and the course schedule of the watch mode.
+'''
+
+import json
+import os
+import time
+
+from src.configs import (DATABASE_NAME, WATCH)
+
+REQUIRED_KEYS = ("username", "password", "download_path", "mode")
+
+
+def load_config(path):
+    """ Load the config file of the headless mode.
+
+    The password may be given by the environment variable UCAS_PASSWORD
+    instead, so that it is not kept in the file.
+    The config of several accounts has a list of "accounts", whose items
+    are merged over the other keys of the file, or "accounts": "database"
+    for the accounts kept in the database (see account_configs).
+    Returns:
+        config: Dictionary, the config with the defaults filled in
+    Raises:
+        ValueError: if a required key is missing or invalid
+    """
+    with open(path, encoding='utf-8') as fd:
+        config = json.load(fd)
+    if "accounts" not in config:
+        if os.environ.get("UCAS_PASSWORD"):
+            config["password"] = os.environ["UCAS_PASSWORD"]
+        return check_config(fill_defaults(config), path)
+    accounts = config.pop("accounts")
+    config = fill_defaults(config)
+    if accounts == "database":
+        config["accounts"] = accounts
+        check_config(dict(config, username="-", password="-", download_path="-"), path)
+    elif isinstance(accounts, list) and accounts:
+        config["accounts"] = [check_config(dict(config, **account), path) for account in accounts]
+    else:
+        raise ValueError(f'accounts should be a list of accounts or "database" in {path}.')
+    return config
+
+
+def fill_defaults(config):
+    config.setdefault("database", DATABASE_NAME)
+    config.setdefault("use_cache", True)
+    config.setdefault("is_from_ucas", "N")
+    config.setdefault("student_id", "")
+    config.setdefault("another_user", False)
+    config.setdefault("courses", "all")
+    config["watch"] = dict(WATCH, **config.get("watch", {}))
+    return config
+
+
+def check_config(config, path):
+    missing = [key for key in REQUIRED_KEYS if not config.get(key)]
+    if missing:
+        raise ValueError(f'Missing {", ".join(missing)} in {path}.')
+    if not isinstance(config["mode"], int) or not 1 <= config["mode"] <= 7:
+        raise ValueError(f'mode should be 1 to 7 in {path}.')
+    return config
+
+
+def account_configs(config, rows):
+    """ Get the configs of the accounts kept in the USERS table.
+    Args:
+        config: Dictionary, the config with "accounts": "database"
+        rows: List of (username, password, download path, is from ucas, student id)
+    """
+    return [dict(config, username=username, password=password, download_path=download_path,
+                 is_from_ucas=is_from_ucas, student_id=student_id)
+            for username, password, download_path, is_from_ucas, student_id in rows]
+
+
+def course_selection(config, m_type):
+    """ Get the courses chosen for the manager of m_type, "all" or a list of names. """
+    courses = config["courses"]
+    if isinstance(courses, dict):
+        courses = courses.get(m_type, "all")
+    return courses
+
+
+class CourseSchedule(object):
+    """ When every course of every manager is synced next.
+
+    A course which had changes in its last sync is synced again after its
+    base interval, while the interval of an inactive course backs off
+    exponentially. A failed sync is retried after the base interval.
+    """
+
+    def __init__(self, config=WATCH):
+        self.interval = config["interval"]
+        self.max_interval = config["max_interval"]
+        self.backoff = config["backoff"]
+        self.course_intervals = config["courses"]
+        # (m_type, course name) -> [interval, due time]
+        self._entries = {}
+
+    def base_interval(self, name):
+        return self.course_intervals.get(name, self.interval)
+
+    def due(self, m_type, courses, now=None):
+        """ Get the courses which should be synced now. """
+        now = time.monotonic() if now is None else now
+        return [course for course in courses
+                if self._entries.get((m_type, course["name"]), [0, now])[1] <= now]
+
+    def update(self, m_type, courses, activity, now=None):
+        """ Schedule the next sync of the synced courses.
+        Args:
+            m_type: String, the type of the manager
+            courses: List of the synced courses
+            activity: Dictionary {course name: number of changes}, without the
+                      failed courses, None if the whole sync failed
+        """
+        now = time.monotonic() if now is None else now
+        for course in courses:
+            name = course["name"]
+            base = self.base_interval(name)
+            entry = self._entries.get((m_type, name))
+            if activity is None or activity.get(name, 1) or entry is None:
+                interval = base
+            else:
+                interval = min(max(self.max_interval, base), entry[0] * self.backoff)
+            self._entries[(m_type, name)] = [interval, now + interval]
+
+    def next_delay(self, now=None):
+        """ Seconds until the next course is due. """
+        now = time.monotonic() if now is None else now
+        if not self._entries:
+            return self.interval
+        return max(0, min(due for _, due in self._entries.values()) - now)
@@ -8,30 +8,140 @@
 """
 
 import asyncio
+import hashlib
 import json
 import os
 import re
 import sqlite3
-import sys
-from bs4 import BeautifulSoup
+import time
 from datetime import datetime
 from getpass import getpass
 from sys import exit
 from urllib import parse
 
-from src.configs import (HTTP_HDRS, SQL_CMD, TARGET_PAGE_TAG, LOGIN_URL)
+from aiohttp import ClientResponseError
+
+from src.cache import HttpCache
+from src.configs import (HTTP_HDRS, SQL_CMD, LOGIN_URL, CRAWL_LIMITS,
+                         DOWNLOAD_LIMITS, HTTP_CACHE, YOUTUBE_DL, COURSEWARE_BACKEND, SAKAI_CONTENT_API,
+                         SESSION_STORE, PORTAL_URL, CRAWL_INDEX)
 from src.downloader import (CoursewareDownloader, VideoDownloader)
+from src.extractor import (extract, extract_resource_page, extract_site_contents, extract_target_url,
+                           extract_unsubmitted_homeworks, extract_video_play, extract_videos, shutdown_pool)
+from src.headless import (CourseSchedule, course_selection)
 from src.logger import logger
+from src.manifest import ManifestStore
+from src.metrics import metrics
+from src.parser import make_soup
+from src.process import ExternalProcessPool
+from src.retry import policy as retry_policy
+from src.scheduler import (CrawlScheduler, DownloadScheduler, ReadWriteLock)
+from src.session import SessionStore
+from src.throttle import bandwidth
+from src.transport import (get_timeout, stats as transport_stats)
+
+
+http_cache = None
+# the caches of the sessions of the accounts synced together, whose pages
+# of the same urls differ
+session_caches = {}
+
+
+def enable_http_cache(directory, session=None):
+    """ Let fetch() cache the pages in directory, only the pages fetched
+    with session if given.
+    """
+    global http_cache
+    if session is None:
+        if http_cache is not None:
+            http_cache.close()
+        http_cache = HttpCache(directory)
+    else:
+        session_caches[session] = HttpCache(directory)
+
+
+def disable_http_cache(session):
+    cache = session_caches.pop(session, None)
+    if cache is not None:
+        cache.close()
+
 
+def get_http_cache(session):
+    return session_caches.get(session, http_cache)
 
-async def fetch(session, url, timeout=10, params=None):
-    async with session.get(url, headers=HTTP_HDRS['normal'], timeout=timeout, params=params, ssl=False) as response:
-        return await response.text()
+
+async def fetch(session, url, timeout=None, params=None):
+    """ Fetch the page, retried by the retry policy on transient errors. """
+    return await retry_policy.call(url, lambda: fetch_once(session, url, timeout, params))
+
+
+async def fetch_once(session, url, timeout=None, params=None):
+    """ Fetch the page, revalidating the cached page by conditional GET if any. """
+    headers = HTTP_HDRS['normal']
+    http_cache = get_http_cache(session)
+    entry = None
+    if http_cache is not None:
+        key = http_cache.key(url, params)
+        entry = await http_cache.run(http_cache.get, key)
+        if entry is not None:
+            headers = dict(headers, **http_cache.validators(entry))
+    async with session.get(url, headers=headers, timeout=timeout or get_timeout("page"),
+                           params=params) as response:
+        if entry is not None and response.status == 304:
+            http_cache.hits += 1
+            await http_cache.run(http_cache.touch, key)
+            return entry['body']
+        response.raise_for_status()
+        text = await response.text()
+        if http_cache is not None and response.status == 200:
+            http_cache.misses += 1
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if etag or last_modified:
+                await http_cache.run(http_cache.put, key, text, etag, last_modified)
+        return text
+
+
+def export_metrics(database_path):
+    """ Collect the counters of the run and write the run report next to the database. """
+    transport = transport_stats.report()
+    for name in ("requests", "connections_created", "connections_reused"):
+        metrics.gauge(name, transport[name])
+    metrics.gauge("bytes_downloaded", bandwidth.total)
+    metrics.gauge("bandwidth_wait_seconds", round(bandwidth.waited, 3))
+    caches = [cache for cache in [http_cache, *session_caches.values()] if cache is not None]
+    if caches:
+        metrics.gauge("http_cache_requests", sum(cache.hits for cache in caches), result="hit")
+        metrics.gauge("http_cache_requests", sum(cache.misses for cache in caches), result="miss")
+    for name, value in retry_policy.stats().items():
+        metrics.gauge(f"retry_{name}", value)
+    directory = os.path.dirname(os.path.abspath(database_path))
+    try:
+        metrics.export(directory)
+        logger.info(f'Run report is written into {directory}.')
+    except OSError as e:
+        logger.error(f'{type(e)}, {e}')
 
 
 class Manager(object):
-    def __init__(self, session, database_path):
+    def __init__(self, session, database_path, config=None, manifest=None, limits=None):
+        """
+        Args:
+            session: ClientSession
+            database_path: String, the path of the database
+            config: Dictionary, the config of the headless mode (see
+                    src.headless.load_config), None to ask the user
+            manifest: AccountManifest of the store shared with other
+                      accounts, None to open the store of the database
+            limits: SharedLimits of the accounts synced together, None
+                    for the limits of this account alone
+        """
         self._managers = {}
+        # the shared manifest, the http cache and the extractor pool are
+        # started and closed by the runner of the accounts (see src.accounts)
+        self.shared = manifest is not None
+        self.limits = limits
+        self.config = config
         self.database_path = database_path
         self.sess = session
         self.courses_list = []
@@ -42,17 +152,29 @@ class Manager(object):
         self.student_id = ''
         self.use_cache = 'Y'
         self.login_info = {}
-        # check and connect database
-        if not os.path.exists(self.database_path):
-            self.db = sqlite3.connect(self.database_path)
-            c = self.db.cursor()
-            dict(map(lambda item: (item[0], c.execute(
-                item[1]['create'])), SQL_CMD.items()))
-            self.db.commit()
+        self.login_result = {}
+        self.session_restored = False
+        self.portal_text = None
+        # connect database and create the missing tables
+        self.db = sqlite3.connect(self.database_path)
+        c = self.db.cursor()
+        dict(map(lambda item: (item[0], c.execute(
+            item[1]['create'])), SQL_CMD.items()))
+        self.db.commit()
+        if self.shared:
+            self.manifest = manifest
+            # every account has its own page cache, as its own session file
+            enable_http_cache(os.path.join(
+                os.path.dirname(os.path.abspath(self.database_path)),
+                f'{HTTP_CACHE["directory"]}-{self.account_id()}'), self.sess)
         else:
-            self.db = sqlite3.connect(self.database_path)
+            self.manifest = ManifestStore(self.database_path, self.db)
+            enable_http_cache(os.path.join(
+                os.path.dirname(os.path.abspath(self.database_path)), HTTP_CACHE["directory"]))
 
     async def check_user(self):
+        if self.config is not None:
+            return await self.check_configured_user()
         self.use_cache = input("Do you want to use cache? (Y/N): ").upper()
         c = self.db.cursor()
         while True:
@@ -69,6 +191,8 @@ class Manager(object):
             else:
                 self.get_user_info()
             self.set_login_info()
+            if self.use_cache == "Y" and await self.restore_session():
+                break
             success = await self.try_login()
             if not success:
                 print(
@@ -78,6 +202,20 @@ class Manager(object):
             else:
                 break
 
+    async def check_configured_user(self):
+        """ Log in as the user of the config file, without asking anything. """
+        self.username = self.config["username"]
+        self.password = self.config["password"]
+        self.download_path = self.config["download_path"]
+        self.is_from_ucas = self.config["is_from_ucas"]
+        self.student_id = self.config["student_id"]
+        self.use_cache = "Y" if self.config["use_cache"] else "N"
+        self.set_login_info()
+        if self.use_cache == "Y" and await self.restore_session():
+            return
+        if not await self.try_login():
+            raise RuntimeError('Failed to login, please check the username and password in the config file.')
+
     def set_login_info(self):
         self.login_info = {
             'username': self.username,
@@ -95,11 +233,17 @@ class Manager(object):
 
     async def try_login(self):
         try:
-            async with self.sess.post(LOGIN_URL, headers=HTTP_HDRS['post'], data=self.login_info, timeout=10) as res:
-                res_json = json.loads(await res.text())
-                return res_json['f']
+            with metrics.span("login", step="form"):
+                async with self.sess.post(LOGIN_URL, headers=HTTP_HDRS['post'], data=self.login_info,
+                                          timeout=get_timeout("login")) as res:
+                    # kept for login(), so that the form is only posted once
+                    self.login_result = json.loads(await res.text())
+                    return self.login_result['f']
         except Exception as e:
             logger.error(f'{type(e)}, {e} login failed.')
+            if self.config is not None:
+                # the other accounts of the process keep running
+                raise RuntimeError(f'Failed to login as {self.username}.') from e
             exit()
 
     def get_user_info(self):
@@ -113,6 +257,8 @@ class Manager(object):
             "li", {"class": "btnav-info", "title": "当前用户所在单位"})
         if name_tag is None:
             logger.error("登录失败，请核对用户名和密码")
+            if self.config is not None:
+                raise RuntimeError(f'Failed to login as {self.username}.')
             exit(0)
         name = name_tag.get_text()
         match = re.compile(r"\s*(\S*)\s*(\S*)\s*").match(name)
@@ -123,15 +269,98 @@ class Manager(object):
         name = match.group(2)
         logger.info(f'{institute} {name} 登录成功！')
 
+    def account_id(self):
+        """ The name of the files of the account among the accounts of the shared database. """
+        return hashlib.sha1(self.config["username"].encode()).hexdigest()[:12]
+
+    def get_session_store(self):
+        filename = SESSION_STORE["file"]
+        if self.shared:
+            # every account of the shared database has its own session file
+            name, ext = os.path.splitext(filename)
+            filename = f'{name}-{self.account_id()}{ext}'
+        return SessionStore(
+            os.path.join(os.path.dirname(os.path.abspath(self.database_path)), filename),
+            f'{self.username}\n{self.password}')
+
+    async def restore_session(self):
+        """ Restore the saved session, and probe whether it is still logged in.
+
+        The probe is the portal page which fetch_course_urls() starts with,
+        so its text is kept for it.
+        Returns:
+            tag: True if the session is restored and valid
+        """
+        store = self.get_session_store()
+        if not store.load(self.sess.cookie_jar):
+            return False
+        with metrics.span("login", step="restore"):
+            try:
+                if await self.probe_session():
+                    self.session_restored = True
+                    logger.info('Saved session restored, skip logging in.')
+                    return True
+            except Exception as e:
+                # the saved session may still be valid, so it is kept
+                logger.error(f'{type(e)}, {e}')
+                self.sess.cookie_jar.clear()
+                return False
+        logger.info('Saved session expired.')
+        self.sess.cookie_jar.clear()
+        store.clear()
+        return False
+
+    async def probe_session(self):
+        """ Fetch the portal page and check whether the session is logged in.
+        The text of the page is kept for fetch_course_urls().
+        Returns:
+            tag: True if logged in, False if the page came back logged out
+        Raises:
+            Exception: if the page could not be fetched, which tells
+                       nothing about the session
+        """
+        self.portal_text = None
+        try:
+            text = await fetch(self.sess, PORTAL_URL)
+        except ClientResponseError as e:
+            if e.status in (401, 403):
+                return False
+            raise
+        noscript = make_soup(text).find('noscript')
+        if noscript is not None and noscript.meta is not None:
+            self.portal_text = text
+            return True
+        return False
+
+    async def ensure_session(self):
+        """ Log in again if the session has expired.
+        Returns:
+            tag: True if the session was still logged in
+        Raises:
+            Exception: if the session could not be probed or logged in
+        """
+        if await self.probe_session():
+            return True
+        logger.info('Session expired, logging in again.')
+        self.sess.cookie_jar.clear()
+        if not await self.try_login():
+            raise RuntimeError('Failed to login again.')
+        await self.login()
+        self.save_session()
+        return False
+
+    def save_session(self):
+        if self.use_cache == "Y":
+            self.get_session_store().save(self.sess.cookie_jar)
+
     async def login(self):
-        async with self.sess.post(
-                LOGIN_URL, headers=HTTP_HDRS['post'], data=self.login_info) as res:
-            res_json = json.loads(await res.text())
-            url, parm = res_json['msg'].split('?')
-        async with self.sess.get(url, headers=HTTP_HDRS['get'], params=parm) as res:
-            soup = BeautifulSoup(await res.text(), 'html.parser')
-            self.print_login_info(soup)
-        await fetch(self.sess, "http://sep.ucas.ac.cn/appStore")
+        url, parm = self.login_result['msg'].split('?')
+        with metrics.span("login", step="portal"):
+            async with self.sess.get(url, headers=HTTP_HDRS['get'], params=parm,
+                                     timeout=get_timeout("login")) as res:
+                soup = make_soup(await res.text(), "login")
+                self.print_login_info(soup)
+            await fetch(self.sess, "http://sep.ucas.ac.cn/appStore")
 
     def check_another_user(self, soup):
         another_user = ''
@@ -151,8 +380,9 @@ class Manager(object):
     async def fetch_course_urls(self):
         """ Get all the course information. """
         try:
-            text = await fetch(self.sess, "http://sep.ucas.ac.cn/portal/site/16/801")
-            soup = BeautifulSoup(text, "html.parser")
+            text = self.portal_text or await fetch(self.sess, PORTAL_URL)
+            self.portal_text = None
+            soup = make_soup(text)
             course_website_url = soup.find(
                 'noscript').meta.get("content")[6:]
             text = await fetch(self.sess, course_website_url)
@@ -160,20 +390,24 @@ class Manager(object):
                 # Must use https here
                 text = await fetch(self.sess, "https://course.ucas.ac.cn/portal",
                                    params={'anotherUser': self.student_id})
-            soup = BeautifulSoup(text, "html.parser")
+            soup = make_soup(text)
             another_user = self.check_another_user(soup)
-            if another_user is not None and self.is_from_ucas.upper() != 'Y':
+            if another_user and self.is_from_ucas.upper() != 'Y':
                 print("Another user detected.")
                 current_user = soup.find('div', {'class': 'Mrphs-userNav__submenuitem--displayid'}).get_text().strip()
                 print(f"Current user: {current_user}")
                 print(f"Another user: {another_user}")
-                change = input("Do you want to change to another user and set it as default(if use cache)? (Y/N): ")
+                if self.config is not None:
+                    change = "Y" if self.config["another_user"] else "N"
+                else:
+                    change = input("Do you want to change to another user and set it as default(if use cache)? (Y/N): ")
                 if change.upper() == "Y":
                     # Must use https here
                     text = await fetch(self.sess, "https://course.ucas.ac.cn/portal",
                                        params={'anotherUser': another_user})
-                    soup = BeautifulSoup(text, "html.parser")
-                    if self.use_cache.upper() == "Y":
+                    soup = make_soup(text)
+                    # the user of the headless mode is kept in the config file
+                    if self.use_cache.upper() == "Y" and self.config is None:
                         self.is_from_ucas = "Y"
                         self.student_id = another_user
                         c = self.db.cursor()
@@ -186,7 +420,7 @@ class Manager(object):
                 'a', {'class': "Mrphs-toolsNav__menuitem--link", 'title': "我的课程 - 查看或加入站点"}).get("href")
             # logDebug(f"all_courses_tab = {all_courses_tab}")
             text = await fetch(self.sess, all_courses_tab)
-            soup = BeautifulSoup(text, "html.parser")
+            soup = make_soup(text)
             all_courses_info = soup.find(
                 'ul', {'class': "otherSitesCategorList favoriteSiteList"}).find_all('div', {'class': "fav-title"})
             for course_info in all_courses_info:
@@ -198,45 +432,142 @@ class Manager(object):
                 self.courses_list.append(course)
         except Exception as e:
             logger.error(f'{type(e)}, {e}')
-            exit(0)
+            raise RuntimeError('Failed to fetch the course list.') from e
 
     async def initialize(self):
         await self.check_user()
-        await self.login()
-        await self.fetch_course_urls()
-        command_line = "Please choose download objects:\n\t1: 下载课件\n\t2: 下载视频\n\t3: 下载课件和视频\n\t4: 检查作业提交情况\nMode = "
-        mode = int(input(command_line))
-        if (mode & 0b01):
-            self._managers['courseware'] = CoursewareManager(
-                self.sess, self.download_path, self.courses_list, self.db)
-        if (mode & 0b10):
-            self._managers['video'] = VideoManager(
-                self.sess, self.download_path, self.courses_list, self.db)
-        if (mode & 0b100):
-            self._managers['homework'] = HomeworkManager(
-                self.sess, self.download_path, self.courses_list, self.db)
+        if not self.session_restored:
+            await self.login()
+            self.save_session()
+        with metrics.span("course_listing"):
+            await self.fetch_course_urls()
+        if self.config is not None:
+            mode = self.config["mode"]
+        else:
+            command_line = "Please choose download objects:\n\t1: 下载课件\n\t2: 下载视频\n\t3: 下载课件和视频\n\t4: 检查作业提交情况\nMode = "
+            mode = int(input(command_line))
+        managers = (('courseware', CoursewareManager), ('video', VideoManager), ('homework', HomeworkManager))
+        for bit, (m_type, manager_class) in enumerate(managers):
+            if mode & (1 << bit):
+                selection = course_selection(self.config, m_type) if self.config is not None else None
+                self._managers[m_type] = manager_class(
+                    self.sess, self.download_path, self.courses_list, self.manifest, selection, self.limits)
+
+    async def refresh_courses(self):
+        """ Fetch the course list again and apply the selections of the managers. """
+        self.courses_list.clear()
+        with metrics.span("course_listing"):
+            await self.fetch_course_urls()
+        for manager in self._managers.values():
+            manager.select_courses(self.courses_list)
 
     async def run(self):
         """Run the pipeline"""
-        await self.initialize()
         try:
-            for _, manager in self._managers.items():
-                await manager.run()
-        except Exception as e:
-            logger.error(f'{type(e)}, {e}')
-            exit(0)
+            await self.initialize()
+            if not self.shared:
+                self.manifest.start()
+            for m_type, manager in self._managers.items():
+                # a failed manager does not stop the others
+                try:
+                    await manager.run()
+                except Exception as e:
+                    logger.error(f'{m_type} manager failed, {type(e)}, {e}')
+        finally:
+            await self.close()
+
+    async def watch(self):
+        """ Sync the courses on schedule until interrupted.
+
+        The session, the connection pool and the manifest are kept in
+        memory between the syncs, so that every sync only crawls the due
+        courses and downloads the changed files.
+        """
+        schedule = CourseSchedule(self.config["watch"])
+        stale = False
+        failures = 0
+        try:
+            await self.initialize()
+            if not self.shared:
+                self.manifest.start()
+            listed = time.monotonic()
+            while True:
+                # a failed probe, login or course listing (e.g. a network
+                # outage) is retried with backoff instead of ending the watch
+                try:
+                    if not await self.ensure_session() or stale or \
+                            time.monotonic() - listed > self.config["watch"]["course_list_interval"]:
+                        stale = True
+                        await self.refresh_courses()
+                        stale = False
+                        listed = time.monotonic()
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    delay = self.retry_delay(failures)
+                    logger.error(f'{type(e)}, {e}, retry in {delay:.0f} seconds.')
+                    await asyncio.sleep(delay)
+                    continue
+                for m_type, manager in self._managers.items():
+                    due = schedule.due(m_type, manager.courses_list)
+                    if not due:
+                        continue
+                    try:
+                        activity = await manager.run(due)
+                    except Exception as e:
+                        logger.error(f'{m_type} manager failed, {type(e)}, {e}')
+                        activity = None
+                    schedule.update(m_type, due, activity)
+                self.export_metrics()
+                delay = schedule.next_delay()
+                logger.info(f'Next sync in {delay:.0f} seconds.')
+                await asyncio.sleep(delay)
+        finally:
+            await self.close()
+
+    def retry_delay(self, failures):
+        """ Seconds to wait after the failures-th failed cycle in a row of the watch mode. """
+        watch = self.config["watch"]
+        return min(watch["retry_delay"] * watch["backoff"] ** (failures - 1), watch["max_interval"])
+
+    async def close(self):
+        self.db.close()
+        if self.shared:
+            return
+        await self.manifest.close()
+        shutdown_pool()
+        logger.info(f'Connection stats: {transport_stats.report()}')
+        logger.info(f'Retry stats: {retry_policy.stats()}')
+        self.export_metrics()
+
+    def export_metrics(self):
+        export_metrics(self.database_path)
 
 
 class BasicManager(object):
-    def __init__(self, session, download_path, courses_list, db, m_type="basic"):
+    def __init__(self, session, download_path, courses_list, manifest, selection=None, limits=None, m_type="basic"):
+        """
+        Args:
+            selection: "all" or List of the names of the chosen courses,
+                       None to ask the user
+            limits: SharedLimits of the accounts synced together, None
+                    for the limits of this manager alone
+        """
         self._type = m_type
         self._downloaders = []
         self._messages = {'update': [], 'new': [], 'error': []}
         self.sess = session
         self.download_path = download_path
         self.courses_list = courses_list
-        self.db = db
-        self.chooseCourses()
+        self.manifest = manifest
+        self.limits = limits
+        self.scheduler = limits.crawl if limits is not None else CrawlScheduler()
+        self.download_scheduler = None
+        self.selection = selection
+        if selection is None:
+            self.chooseCourses()
+        else:
+            self.select_courses(courses_list)
 
     def chooseCourses(self):
         print(f"\n{'*' * 6} {self._type.upper()} MANAGER INFO {'*' * 6}")
@@ -260,14 +591,38 @@ class BasicManager(object):
             print(f"{course['name']}")
         print()
 
-    def add_report_message(self, mode, msg):
-        self._messages[mode].append(msg)
+    def select_courses(self, courses_list):
+        """ Choose the courses by the selection, without asking the user. """
+        if self.selection == "all":
+            self.courses_list = list(courses_list)
+            return
+        names = set(self.selection)
+        self.courses_list = [course for course in courses_list if course["name"] in names]
+        for name in names - {course["name"] for course in self.courses_list}:
+            logger.info(f'Course {name} is not found.')
+
+    def add_report_message(self, mode, msg, course=None):
+        """
+        Args:
+            course: String, the name of the course of the message, None if
+                    the message is added in the order of the courses already
+        """
+        self._messages[mode].append((course, msg))
+
+    async def fetch(self, url, **kwargs):
+        """ Fetch the page under the per-host limit of the scheduler. """
+        async with self.scheduler.host(url):
+            return await fetch(self.sess, url, **kwargs)
 
     def report(self):
         logger.info(
             f"{'*' * 6} REPORT OF {self._type.upper()} MANAGER START {'*' * 6}.")
+        # the downloads finish in any order, so the messages of the courses
+        # are sorted by the order of the courses and then by the path
+        ranks = {course["name"]: rank for rank, course in enumerate(self.courses_list)}
         for key, messages in self._messages.items():
-            for msg in messages:
+            for _, msg in sorted(messages, key=lambda message: (ranks.get(message[0], len(ranks)),
+                                                                message[1] if message[0] is not None else '')):
                 logger.info(f"{key.upper()}: {msg}")
             if len(messages) == 0:
                 logger.info(f"There are no {key} {self._type}s.")
@@ -284,159 +639,290 @@ class BasicManager(object):
             courseUrl: String, the url of course main page
 
         Returns:
-            resource_page_obj: BeatifulSoup Object, parse the resource page
+            resource_page_url: String, the url of the target page
+            text: String, the html of the target page,
+                  (None, None) if the course has no such page
+        Raises:
+            Exception: if a page could not be fetched or parsed, which
+                       fails the course
         """
-        text = await fetch(self.sess, courseUrl)
-        soup = BeautifulSoup(text, "html.parser")
-        try:
-            resource_page_url = soup.find(
-                'a', TARGET_PAGE_TAG[self._type]).get("href")
-            text = await fetch(self.sess, resource_page_url)
-            resource_page_obj = BeautifulSoup(text, 'html.parser')
-            # if self._type == "video":
-            # return [resource_page_url, resource_page_obj]
-            return resource_page_url, resource_page_obj
-        except Exception as e:
-            print(
-                f"[{sys._getframe().f_code.co_name}:{sys._getframe().f_lineno}] Exception", e, type(e))
+        text = await self.fetch(courseUrl)
+        resource_page_url = await extract(extract_target_url, text, self._type)
+        if resource_page_url is None:
+            logger.info(f'No {self._type} page in {courseUrl}.')
             return None, None
+        text = await self.fetch(resource_page_url)
+        return resource_page_url, text
 
     async def get_target_info(self, course):
-        pass
+        """ Get the targets of single course, which are returned as a list. """
+        return []
+
+    def add_targets(self, targets):
+        self._downloaders.extend(targets)
 
-    async def run_downloaders(self):
+    async def run_downloader(self, downloader):
         pass
 
-    async def get_resource_info_list(self):
-        for course in self.courses_list:
-            await self.get_target_info(course)
+    async def get_resource_info_list(self, courses):
+        """ Crawl the courses concurrently.
 
-    async def run(self):
-        """Run the pipeline"""
-        await self.get_resource_info_list()
+        The targets are collected in the order of courses, no matter which
+        course finishes first.
+        Returns:
+            activity: Dictionary {course name: number of targets}, without
+                      the courses which failed to be crawled
+        """
+        async def crawl(course):
+            try:
+                with metrics.span("discovery", type=self._type, course=course["name"]):
+                    return await self.get_target_info(course)
+            except Exception as e:
+                self.add_course_error(course, e)
+                return None
+        results = await self.scheduler.map(crawl, courses)
+        for targets in results:
+            self.add_targets(targets or [])
+        return {course["name"]: len(targets) for course, targets in zip(courses, results) if targets is not None}
+
+    async def produce_downloaders(self, courses):
+        """ Crawl the courses concurrently and schedule the downloaders
+        of each course as soon as the course is crawled.
+
+        Files which do not need downloading are not scheduled at all.
+        The rank of the course is its index in courses, where recent
+        courses come first.
+        Returns:
+            activity: Dictionary {course name: number of scheduled downloaders},
+                      without the courses which failed to be crawled
+        """
+        activity = {}
+
+        async def crawl(item):
+            rank, course = item
+            try:
+                with metrics.span("discovery", type=self._type, course=course["name"]):
+                    targets = await self.get_target_info(course)
+            except Exception as e:
+                # one failed course does not stop the others
+                self.add_course_error(course, e)
+                return
+            activity[course["name"]] = 0
+            for downloader in targets or []:
+                if downloader.check_status():
+                    activity[course["name"]] += 1
+                    await self.download_scheduler.put(
+                        downloader, downloader.priority(rank), downloader.url)
+        await self.scheduler.map(crawl, list(enumerate(courses)))
+        return activity
+
+    def add_course_error(self, course, e):
+        logger.error(f'{type(e)}, {e}, in {course["name"]}')
+        self.add_report_message('error', f'Failed to check the {self._type}s of {course["name"]}, {type(e)}, {e}',
+                                course["name"])
+
+    def reset_report(self):
+        self._messages = {key: [] for key in self._messages}
+
+    async def run(self, courses=None):
+        """Run the pipeline
+
+        Crawling and downloading run at the same time: the crawler puts
+        downloaders into the bounded priority queue of the download
+        scheduler, and its workers take them out and download the files.
+        Args:
+            courses: List of the courses to sync, None for self.courses_list
+        Returns:
+            activity: Dictionary {course name: number of scheduled downloaders}
+        """
+        courses = self.courses_list if courses is None else courses
+        activity = {}
+        self.reset_report()
         start = datetime.now()
         try:
             logger.info(f'Going to arrange downloading {self._type} tasks.')
-            await self.run_downloaders()
+            self.download_scheduler = DownloadScheduler(
+                self.run_downloader, DOWNLOAD_LIMITS["workers"][self._type],
+                budget=self.limits.download(self._type) if self.limits is not None else None)
+            self.download_scheduler.start()
+            try:
+                activity = await self.produce_downloaders(courses)
+            finally:
+                await self.download_scheduler.join()
             stop = datetime.now()
             logger.info(
                 f'All downloaders cost {(stop - start).total_seconds()} seconds.')
-            self.report()
+            stats = self.download_scheduler.stats()
+            logger.info(f'Download scheduler stats: {stats}')
+            metrics.gauge("download_seconds", (stop - start).total_seconds(), type=self._type)
+            if stats["concurrency"] is not None:
+                metrics.gauge("download_concurrency", stats["concurrency"]["settled_limit"], type=self._type)
         except Exception as e:
+            self.add_report_message('error', f'Stopped before all the {self._type}s were checked, {type(e)}, {e}')
             logger.error(f'{type(e)}, {e}')
-            exit(0)
+        self.report()
+        return activity
 
 
 class CoursewareManager(BasicManager):
-    def __init__(self, session, download_path, courses_list, db):
+    def __init__(self, session, download_path, courses_list, manifest, selection=None, limits=None):
         super(CoursewareManager, self).__init__(
-            session, download_path, courses_list, db, m_type="courseware")
+            session, download_path, courses_list, manifest, selection, limits, m_type="courseware")
+        self._listings = {}
+        self._failed_courses = set()
 
-    async def get_resources_info(self, resource_page_obj, parent_dir=""):
+    async def get_resources_info(self, resource_page, post_pattern, listing):
         """ Get the information of coursewares.
         Get the information of coursewares, e.g. the filename of the courseware,
         the url of the courseware.
-        The process of this function is as follows:
-                ┌──── 获取当前文件夹下的所有文件的信息（文件名+文件下载链接）
+        A folder whose listing is unchanged since the last complete sync of
+        the course is skipped with its subfolders.
+        The folders are traversed breadth-first, and the sibling folders of
+        the same level are unfolded concurrently:
+                ┌──── 获取当前层所有文件夹下的文件的信息（文件名+文件下载链接）
                 │            │
-                │     获取当前文件夹下的所有文件夹
+                │     获取当前层所有文件夹下的子文件夹
                 │            │
-                │        1. 根据当前页面发POST请求
-                │        2. 获得子文件夹的页面
-                │        3. 调用自己
+                │        1. 并发地发POST请求（限制并发数）
+                │        2. 获得子文件夹的页面，作为下一层
                 │            │
                 └────────────┘
-        The information of the resources is stored in self.resource_infos,
-        which is a list.
         Args:
-            resource_page_obj: BeautifulSoup Object, parse the current web page
-            parent_dir: String, the path of the parrent directory
+            resource_page: Dictionary, extracted from the resource page
+            post_pattern: Dictionary, the post pattern of the course
+            listing: Dictionary {
+                        "course": the url of the course,
+                        "fingerprints": {collection_id: fingerprint} of the walked folders,
+                        "complete": False if some folder failed to be unfolded
+                     }, updated by the traversal
         Returns:
-            None
+            resource_infos: List of the information of files
         """
-        # get urls of files under current directory
-        self.get_files_info_of_current_dir(resource_page_obj, parent_dir)
-        # get urls of files under subfolders
-        subDirPageInfoList = await self.get_subdir_page_objects(resource_page_obj, parent_dir)
-        for subDirPageObj, subDir in subDirPageInfoList:
-            await self.get_resources_info(subDirPageObj, subDir)
-
-    def get_files_info_of_current_dir(self, resource_page_obj, parent_dir):
-        """ Get the information of files in the current web page.
+        resource_infos = []
+        fanout = asyncio.Semaphore(CRAWL_LIMITS["folder_fanout"])
+        level = [resource_page]
+        while level:
+            sub_dirs = []
+            for page in level:
+                collection_id = page["collection_id"]
+                if collection_id is not None:
+                    if page["fingerprint"] == self.get_known_fingerprint(listing["course"], collection_id):
+                        # its record is kept with the time of its last walk,
+                        # so that it is walked again once the record expires
+                        continue
+                    listing["fingerprints"][collection_id] = page["fingerprint"]
+                # get urls of files under current directory
+                resource_infos.extend(page["files"])
+                sub_dirs.extend(page["subdirs"])
+
+            async def unfold(sub_dir):
+                collection_id, folder_name = sub_dir
+                print("发现子文件夹 {:s}".format(folder_name))
+                async with fanout:
+                    return await self.get_subdir_page(post_pattern, collection_id, folder_name)
+            # get the pages of all subfolders of the next level
+            level = await asyncio.gather(*[unfold(sub_dir) for sub_dir in sub_dirs])
+            if None in level:
+                listing["complete"] = False
+            level = [page for page in level if page is not None]
+        return resource_infos
+
+    def get_known_fingerprint(self, course, collection_id):
+        """ The fingerprint of the folder in the last complete sync, None if unknown. """
+        if not CRAWL_INDEX["enabled"]:
+            return None
+        return self.manifest.lookup_listing(course, collection_id, CRAWL_INDEX["max_age"])
+
+    async def get_subdir_page(self, post_pattern, collection_id, folder_name):
+        """ Get the extracted page of the subfolder.
+
+        The folder which is navigated to is kept in the server-side session
+        state of the course, so concurrent navigations of the same course
+        may render the page of a sibling folder. Such a page is detected by
+        its collection id, and the navigation is retried while holding the
+        lock of the course, which makes it exclusive.
         Args:
-            resource_page_obj: BeautifulSoup Object, parse the current web page
-            parent_dir: String, the path of the parrent directory
+            post_pattern: Dictionary, the post pattern of the course
+            collection_id: String, the collection id of the subfolder
+            folder_name: String, the path of the subfolder
         Returns:
-            None
+            sub_page: Dictionary, extracted from the subfolder page, None if failed
         """
-        rows = resource_page_obj.find_all("tr")
-        resource_list = []
-        for row in rows:
-            link = row.find("a").get('href')
-            if link == '#':
-                continue
-            date = row.find(
-                "td", {"class": "modified hidden-sm hidden-xs"}).get_text().strip()
-            resource_list.append({"href": link, "date": date})
-        for resource in resource_list:
-            resource_info = {}
-            resource_info["subDir"] = parent_dir
-            resource_info["url"] = resource['href']
-            resource_info["fileName"] = parse.unquote(os.path.basename(
-                resource['href']))
-            resource_info["date"] = resource['date']
-            self.resource_infos.append(resource_info)
-
-    async def get_subdir_page_objects(self, resource_page_obj, parent_dir):
-        """ Get the information of files in the subfolder web page.
+        form_data = {
+            'source': '0', 'collectionId': collection_id,
+            'navRoot': '', 'criteria': 'title',
+            'sakai_action': 'doNavigate', 'rt_action': '', 'selectedItemId': '', 'itemHidden': 'false',
+            'itemCanRevise': 'false',
+            'sakai_csrf_token': post_pattern["sakai_csrf_token"]
+        }
+
+        async def navigate():
+            function_url = post_pattern["function_url"]
+            async with self.scheduler.host(function_url):
+                async with self.sess.post(function_url, data=form_data, allow_redirects=True,
+                                          timeout=get_timeout("page")) as res:
+                    text = await res.text()
+            return await extract(extract_resource_page, text, folder_name)
+        try:
+            async with post_pattern["shared"]:
+                sub_page = await navigate()
+            current = sub_page["collection_id"]
+            if current is not None and current != collection_id:
+                async with post_pattern["exclusive"]:
+                    sub_page = await navigate()
+            return sub_page
+        except Exception as e:
+            logger.error(f'{type(e)}, {e}, in {collection_id}')
+            return None
+
+    def get_unfold_post_pattern(self, resource_page):
+        """ Get the data form of post for unfolding subdirectories.
+        The pattern belongs to one course, so it is returned instead of
+        being stored on the manager, which crawls several courses at once.
         Args:
-            resource_page_obj: BeautifulSoup Object, parse the current web page
-            parent_dir: String, the path of the parrent directory
+            resource_page: Dictionary, extracted from the resource page
         Returns:
-            sub_dir_page_objs: BeautifulSoup Object List, all the subfolders' parsered object
+            post_pattern: Dictionary {
+                            "function_url": the option url of the course,
+                            "sakai_csrf_token": param of the post packets,
+                            "shared"/"exclusive": locks of the navigation
+                        }
         """
-        sub_dir_page_objs = []
-        # To find whether there exist subdirs
-        sub_dir_resource_list = resource_page_obj.find_all(
-            'td', {'class': 'attach', 'headers': 'checkboxes'})
-        # print(sub_dir_resource_list)
-        if len(sub_dir_resource_list) == 0:
-            return
-        sub_dir_resource_list.pop(0)
-        for sub_dir_resource_obj in sub_dir_resource_list:
-            collection_id = sub_dir_resource_obj.input.get('value')
-            if collection_id[-1] != '/':
-                continue
-            # fileBaseName = os.path.basename(collectionId)
-            folder_name = os.path.join(
-                parent_dir, collection_id.split("/")[-2])
-            print("发现子文件夹 {:s}".format(folder_name))
-            form_data = {
-                'source': '0', 'collectionId': collection_id,
-                'navRoot': '', 'criteria': 'title',
-                'sakai_action': 'doNavigate', 'rt_action': '', 'selectedItemId': '', 'itemHidden': 'false',
-                'itemCanRevise': 'false',
-                'sakai_csrf_token': self.sakai_csrf_token
-            }
-            async with self.sess.post(
-                    self.function_url, data=form_data, allow_redirects=True) as res:
-                sub_page_obj = BeautifulSoup(await res.text(), "html.parser")
-                sub_dir_page_objs.append((sub_page_obj, folder_name))
-        return sub_dir_page_objs
-
-    def get_unfold_post_pattern(self, resourcePageObj):
-        """ Get the data form of post for unfolding subdirectories.
+        shared, exclusive = ReadWriteLock().pair()
+        return {"function_url": resource_page["function_url"],
+                "sakai_csrf_token": resource_page["sakai_csrf_token"],
+                "shared": shared, "exclusive": exclusive}
+
+    async def get_resources_info_by_api(self, course_url, listing):
+        """ Get the information of coursewares from the Sakai content API.
+
+        The whole resource tree of the site is listed in one request, which
+        is skipped if it is unchanged since the last complete sync.
         Args:
-            resourcePageObj: BeautifulSoup Object, parse the current web page
+            course_url: String, the url of the course main page
+            listing: Dictionary, see get_resources_info()
         Returns:
-            None
+            resource_infos: List of the information of files, None if the
+                            API is unavailable
         """
-        # to get the option url
-        self.function_url = resourcePageObj.find('form').get('action')
-        # to get the sakai_csrf_token,
-        #    which is a param of the post packets in HTTP requests
-        self.sakai_csrf_token = resourcePageObj.find(
-            'input', {'name': 'sakai_csrf_token'}).get('value')
+        match = re.search(r'/site/([^/?#]+)', course_url)
+        if match is None:
+            return None
+        url = parse.urlsplit(course_url)
+        api_url = SAKAI_CONTENT_API.format(base=f'{url.scheme}://{url.netloc}', site_id=match.group(1))
+        try:
+            text = await self.fetch(api_url)
+            # only the fingerprint of a listing which is parsed is trusted,
+            # not that of an error or login page answered with 200
+            resource_infos = await extract(extract_site_contents, text, match.group(1))
+            fingerprint = hashlib.sha1(text.encode('utf-8')).hexdigest()
+            if fingerprint == self.get_known_fingerprint(course_url, api_url):
+                return []
+            listing["fingerprints"][api_url] = fingerprint
+            return resource_infos
+        except Exception as e:
+            logger.error(f'{type(e)}, {e}, fall back to the resource pages of {course_url}')
+            return None
 
     async def get_target_info(self, course_info):
         """ Get information of coursewares of single course.
@@ -447,137 +933,162 @@ class CoursewareManager(BasicManager):
                             "name": the name of the course
                         }
         Returns:
-            None
+            downloaders: List of CoursewareDownloader of this course
         """
-        self.resource_infos = []
         # Get Course directory
         course_name = course_info["name"]
         course_dir = os.path.join(self.download_path, course_name, 'Lectures')
         if not os.path.exists(course_dir):
             os.makedirs(course_dir)
-        # redirect to the resource page of the course website
-        _, resource_page_obj = await self.redirect_to_target_page(course_info["url"])
-        if resource_page_obj is None:
-            return False
-        self.get_unfold_post_pattern(resource_page_obj)
-        await self.get_resources_info(resource_page_obj)
-        # print(self.resource_infos)
-        for courseware in self.resource_infos:
-            self.add_downloader(course_name, course_dir, courseware)
-        return True
-
-    def add_downloader(self, course_name, course_dir, courseware):
+        resource_infos = None
+        listing = {"course": course_info["url"], "fingerprints": {}, "complete": True}
+        if COURSEWARE_BACKEND == "rest":
+            resource_infos = await self.get_resources_info_by_api(course_info["url"], listing)
+        if resource_infos is None:
+            # redirect to the resource page of the course website
+            _, text = await self.redirect_to_target_page(course_info["url"])
+            if text is None:
+                return []
+            resource_page = await extract(extract_resource_page, text, "")
+            post_pattern = self.get_unfold_post_pattern(resource_page)
+            resource_infos = await self.get_resources_info(resource_page, post_pattern, listing)
+        if listing["complete"]:
+            # committed by run() once the files of the course are downloaded
+            self._listings[course_name] = listing
+        if not resource_infos:
+            logger.info(f'No changes in {course_name}.')
+        # print(resource_infos)
+        return [self.create_downloader(course_name, course_dir, courseware)
+                for courseware in resource_infos]
+
+    def create_downloader(self, course_name, course_dir, courseware):
         sub_dir_name = os.path.join(course_dir, courseware["subDir"])
         if not os.path.exists(sub_dir_name):
             os.makedirs(sub_dir_name)
         path = os.path.join(sub_dir_name, courseware["fileName"])
         # print(f"[{courseware['date']}]: {courseware['fileName']}")
-        self._downloaders.append(CoursewareDownloader(
-            self, course_name, courseware['url'], path, courseware['date'], self.db))
+        return CoursewareDownloader(
+            self, course_name, courseware['url'], path, courseware['date'], self.manifest,
+            size=courseware.get('size'))
 
-    async def run_downloaders(self):
-        tasks = [downloader.create_task(self.sess)
-                 for downloader in self._downloaders]
-        await asyncio.gather(*tasks)
+    async def run_downloader(self, downloader):
+        if not await downloader.run(self.sess):
+            self._failed_courses.add(downloader.course)
+
+    async def run(self, courses=None):
+        """ Run the pipeline, then record the fingerprints of the folders of
+        the courses which are crawled completely and whose files are all
+        downloaded, so that they can be skipped next time.
+        """
+        self._listings = {}
+        self._failed_courses = set()
+        activity = await super(CoursewareManager, self).run(courses)
+        for course_name, listing in self._listings.items():
+            if course_name in activity and course_name not in self._failed_courses:
+                self.manifest.record_listings(listing["course"], listing["fingerprints"])
+        return activity
 
 
 class VideoManager(BasicManager):
-    def __init__(self, session, download_path, courses_list, db):
+    def __init__(self, session, download_path, courses_list, manifest, selection=None, limits=None):
         super(VideoManager, self).__init__(
-            session, download_path, courses_list, db, m_type="video")
-
-    def get_video_id_and_date(self, soup):
-        infos = []
-        video_divs = soup.find_all("div", {"class": "col"})
-        # videoTagAs = [div.find("a") for div in video_divs]
-        for div in video_divs:
-            video_id = div.find("a").get('onclick').strip(
-                "gotoPlay('").split(',')[0].strip("'")
-            date = list(filter(lambda x: "上传时间" in x.get_text(),
-                               div.find_all("div", {"class": "col_1"})))
-            limit = list(filter(lambda x: "视频预计" in x.get_text(),
-                                div.find_all("div", {"class": "col_1"})))
-            if limit != []:
-                continue
-            try:
-                date = date[0].get_text().strip("上传时间：")
-            except:
-                date = "Null"
-            # print("video_id && date: ", video_id, date)
-            infos.append((video_id, date))
-        return infos
+            session, download_path, courses_list, manifest, selection, limits, m_type="video")
+        self.process_pool = ExternalProcessPool(YOUTUBE_DL["processes"])
 
     async def get_url_by_video_id(self, videoId, apiUrl):
         try:
-            text = await fetch(self.sess, apiUrl + '/video/play', params={
+            text = await self.fetch(apiUrl + '/video/play', params={
                 "id": videoId, "type": "u"})
-            soup = BeautifulSoup(text, "html.parser")
-            url = soup.find("video").find("source").get("src")
-            name = soup.find(
-                "h2", {"style": "margin-left: 2em;margin-top: 10px"}).get_text()
-            return name, url
+            return await extract(extract_video_play, text)
         except Exception as e:
             logger.error(f'{type(e)}, {e}')
             return "", ""
 
+    async def resolve_video(self, video_id, video_date, api_url, course_dir):
+        """ Get the name and url of the video, from the cache if possible.
+
+        The play page is not fetched if the video is cached with the same
+        upload date and its file is already downloaded, otherwise the url
+        may have expired and is resolved again.
+        Returns:
+            (name, url, date): Tuple, name and url are "" if failed
+        """
+        cached = self.manifest.lookup_video(video_id)
+        if cached is not None:
+            name, url, date = cached
+            path = self.get_video_path(course_dir, name)
+            if date == video_date and self.manifest.lookup(self._type, path) == video_date:
+                return name, url, video_date
+        name, url = await self.get_url_by_video_id(video_id, api_url)
+        if name and url:
+            self.manifest.record_video(video_id, name, url, video_date)
+        return name, url, video_date
+
     async def get_target_info(self, course_info):
-        self.videos_info = []
         course_name = course_info["name"]
         course_dir = os.path.join(self.download_path, course_name, 'Videos')
         # print(f"Course: {course_name}")
         if not os.path.exists(course_dir):
             os.makedirs(course_dir)
         # redirect to the resource page of the course website
-        api_url, resource_page_obj = await self.redirect_to_target_page(course_info["url"])
-        if resource_page_obj == None:
-            return False
-        videos_info = self.get_video_id_and_date(resource_page_obj)
-        for video_id, video_date in videos_info:
-            name, url = await self.get_url_by_video_id(video_id, api_url)
-            self.videos_info.append((name, url, video_date))
-        self.videos_info = list(filter(lambda x: "" not in x, self.videos_info))
-        for video_info in self.videos_info:
-            self.add_downloader(course_name, course_dir, video_info)
-        return True
-
-    def add_downloader(self, course_name, course_dir, video_info):
-        name, url, date = video_info
+        api_url, text = await self.redirect_to_target_page(course_info["url"])
+        if text is None:
+            return []
+        resolving = asyncio.Semaphore(CRAWL_LIMITS["video_resolve"])
+
+        async def resolve(video):
+            async with resolving:
+                return await self.resolve_video(*video, api_url, course_dir)
+        videos_info = await asyncio.gather(
+            *[resolve(video) for video in await extract(extract_videos, text)])
+        videos_info = list(filter(lambda x: "" not in x, videos_info))
+        return [self.create_downloader(course_name, course_dir, video_info)
+                for video_info in videos_info]
+
+    def get_video_path(self, course_dir, name):
         # avoid the existance of space in file name
         name = name.replace(' ', '_').replace('/', '')
-        path = os.path.join(course_dir, f"{name}.mp4")
+        return os.path.join(course_dir, f"{name}.mp4")
+
+    def create_downloader(self, course_name, course_dir, video_info):
+        name, url, date = video_info
+        path = self.get_video_path(course_dir, name)
         # print(f"[{courseware['date']}]: {courseware['fileName']}")
-        self._downloaders.append(VideoDownloader(
-            self, course_name, url, path, date, self.db))
+        return VideoDownloader(
+            self, course_name, url, path, date, self.manifest)
 
-    async def run_downloaders(self):
-        tasks = [downloader.create_task()
-                 for downloader in self._downloaders]
-        await asyncio.gather(*tasks)
+    async def run_downloader(self, downloader):
+        await downloader.run(self.sess)
 
 
 class HomeworkManager(BasicManager):
-    def __init__(self, session, download_path, courses_list, db):
+    def __init__(self, session, download_path, courses_list, manifest, selection=None, limits=None):
         super(HomeworkManager, self).__init__(
-            session, download_path, courses_list, db, m_type="homework")
-        self._messages = {"warning": []}
+            session, download_path, courses_list, manifest, selection, limits, m_type="homework")
+        self._messages = {"warning": [], "error": []}
 
     async def get_target_info(self, course_info):
+        """ Get the warnings of homeworks which are not submitted yet. """
+        warnings = []
         course_name = course_info["name"]
         # redirect to the resource page of the course website
-        _, resource_page_obj = await self.redirect_to_target_page(course_info["url"])
-        if resource_page_obj == None:
-            return False
+        _, text = await self.redirect_to_target_page(course_info["url"])
+        if text is None:
+            return warnings
         try:
-            homeworks = resource_page_obj.find_all("tr")[1:]
-            for homework in homeworks:
-                status = homework.find("td", {"headers": "status"}).get_text().strip()
-                if status == "尚未提交":
-                    name = homework.find("td", {"headers": "title"}).find("a").get_text()
-                    due_date = homework.find("td", {"headers": "dueDate"}).find("span").get_text()
-                    self.add_report_message("warning", f"{course_name}/{name}未提交，截止日期：{due_date}")
+            for name, due_date in await extract(extract_unsubmitted_homeworks, text):
+                warnings.append(f"{course_name}/{name}未提交，截止日期：{due_date}")
         except Exception as e:
             logger.error(f'{type(e)}, {e}, in {course_name}')
+        return warnings
 
-    async def run(self):
-        await self.get_resource_info_list()
+    def add_targets(self, targets):
+        for msg in targets:
+            self.add_report_message("warning", msg)
+
+    async def run(self, courses=None):
+        self.reset_report()
+        activity = await self.get_resource_info_list(
+            self.courses_list if courses is None else courses)
         self.report()
+        return activity
@@ -0,0 +1,224 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : manifest.py
+@Description: Manifest store of downloaded files with batched writes.
+'''
+
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.configs import (SQL_CMD, MANIFEST)
+from src.logger import logger
+from src.metrics import metrics
+
+
+class ManifestStore(object):
+    """ Records of the downloaded files in the database.
+
+    The FILES and VIDEO tables are loaded once into an in-memory index
+    keyed by path, so every lookup is answered without a query. So is the
+    VIDEO_IDS table, which caches the resolved videos keyed by video id, and
+    the LISTINGS table of the fingerprints of the folder listings. The files
+    are indexed by their content hash and ETag as well, for deduplication. Recorded
+    files are marked dirty in the index and written back by a single
+    writer task, which batches them and runs executemany in its own
+    thread with its own connection. The database is in WAL mode.
+    A record should only be written after its file is downloaded.
+    """
+    D_TYPES = ("courseware", "video")
+
+    def __init__(self, database_path, db):
+        self.database_path = database_path
+        self.db = db
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.migrate()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._writer_db = None
+        self._index = None
+        self._dirty = {}
+        self._wakeup = None
+        self._stopped = False
+        self._task = None
+
+    def migrate(self):
+        """ Add the columns which are missing in the tables of older versions. """
+        for d_type in self.D_TYPES:
+            for statement in SQL_CMD[d_type].get("migrate", []):
+                try:
+                    self.db.execute(statement)
+                except sqlite3.OperationalError:
+                    # the column exists already
+                    pass
+        self.db.commit()
+
+    def load(self):
+        """ Load the whole tables into the index, {d_type: {path: date}}
+        and {"video_id": {video_id: (title, url, upload_date)}}.
+        """
+        with metrics.span("db", op="load"):
+            # {(d_type, path): (hash, size, etag)}, {(hash, size): {(d_type, path)}}
+            # and {(etag, size): (d_type, path)}
+            self._index = {"file_content": {}, "content": {}, "etag": {}}
+            for d_type in self.D_TYPES:
+                self._index[d_type] = {}
+                for path, date, digest, size, etag in self.db.execute(SQL_CMD[d_type]['load']):
+                    self._index[d_type][path] = date
+                    self._index_content(d_type, path, digest, size, etag)
+            self._index["video_id"] = {row[0]: tuple(row[1:])
+                                       for row in self.db.execute(SQL_CMD["video_id"]['load'])}
+            self._index["listing"] = {(course, collection_id): (fingerprint, update_time)
+                                      for course, collection_id, fingerprint, update_time
+                                      in self.db.execute(SQL_CMD["listing"]['load'])}
+        logger.info(
+            f"Manifest loaded, {sum(len(self._index[d_type]) for d_type in self.D_TYPES)} files recorded.")
+
+    def lookup(self, d_type, path):
+        """ Get the recorded update time of the file, None if not recorded. """
+        if self._index is None:
+            self.load()
+        return self._index[d_type].get(path)
+
+    def _index_content(self, d_type, path, digest, size, etag):
+        old = self._index["file_content"].pop((d_type, path), None)
+        if old is not None:
+            self._index["content"].get(old[:2], set()).discard((d_type, path))
+            if self._index["etag"].get((old[2], old[1])) == (d_type, path):
+                del self._index["etag"][(old[2], old[1])]
+        if digest is None:
+            return
+        self._index["file_content"][(d_type, path)] = (digest, size, etag)
+        self._index["content"].setdefault((digest, size), set()).add((d_type, path))
+        if etag:
+            self._index["etag"][(etag, size)] = (d_type, path)
+
+    def lookup_content(self, digest, size):
+        """ Get the paths of the recorded files with the content. """
+        if self._index is None:
+            self.load()
+        return [path for _, path in self._index["content"].get((digest, size), ())]
+
+    def lookup_etag(self, etag, size):
+        """ Get (path, hash) of the recorded file with the ETag and size, None if not found. """
+        if self._index is None:
+            self.load()
+        key = self._index["etag"].get((etag, size))
+        if key is None:
+            return None
+        return key[1], self._index["file_content"][key][0]
+
+    def lookup_video(self, video_id):
+        """ Get the cached (title, url, upload_date) of the video, None if not cached. """
+        if self._index is None:
+            self.load()
+        return self._index["video_id"].get(video_id)
+
+    def record_video(self, video_id, title, url, upload_date):
+        self._index["video_id"][video_id] = (title, url, upload_date)
+        self._dirty[("video_id", video_id)] = [video_id, title, url, upload_date]
+        self._wakeup.set()
+
+    def lookup_listing(self, course, collection_id, max_age):
+        """ Get the fingerprint of the folder listing recorded in the last
+        max_age seconds, None if not recorded or too old.
+        """
+        if self._index is None:
+            self.load()
+        fingerprint, update_time = self._index["listing"].get((course, collection_id), (None, 0))
+        return fingerprint if time.time() - update_time <= max_age else None
+
+    def record_listings(self, course, fingerprints):
+        """ Record the fingerprints {collection_id: fingerprint} of the course. """
+        now = time.time()
+        for collection_id, fingerprint in fingerprints.items():
+            self._index["listing"][(course, collection_id)] = (fingerprint, now)
+            self._dirty[("listing", (course, collection_id))] = [course, collection_id, fingerprint, now]
+        self._wakeup.set()
+
+    def start(self):
+        if self._index is None:
+            self.load()
+        self._wakeup = asyncio.Event()
+        self._stopped = False
+        self._task = asyncio.create_task(self._write_loop())
+
+    def record(self, d_type, path, url, date, digest=None, size=None, etag=None):
+        """ Record the downloaded file, which is written in the next batch.
+        Args:
+            digest: String, the sha256 of the content, None if unknown
+            size: Integer, the size of the file
+            etag: String, the ETag of the file on the server
+        """
+        self._index[d_type][path] = date
+        self._index_content(d_type, path, digest, size, etag)
+        self._dirty[(d_type, path)] = [path, url, date, digest, size, etag]
+        self._wakeup.set()
+
+    async def close(self):
+        """ Write all the dirty records and stop the writer. """
+        if self._task is not None:
+            self._stopped = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self._executor, self._close_writer_db)
+
+    async def _write_loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await self._wakeup.wait()
+            if not self._stopped:
+                # wait for a while to gather more records into the batch
+                await asyncio.sleep(MANIFEST["flush_interval"])
+            self._wakeup.clear()
+            while self._dirty:
+                keys = list(self._dirty)[:MANIFEST["batch_size"]]
+                batch = [(key[0], self._dirty.pop(key)) for key in keys]
+                try:
+                    await loop.run_in_executor(self._executor, self._write, batch)
+                except Exception as e:
+                    logger.error(f'{type(e)}, {e}')
+            if self._stopped:
+                break
+
+    def _write(self, batch):
+        """ Write the batch in one transaction, run in the writer thread. """
+        if self._writer_db is None:
+            self._writer_db = sqlite3.connect(self.database_path)
+        rows = {}
+        for d_type, row in batch:
+            rows.setdefault(d_type, []).append(row)
+        with metrics.span("db", op="write"), self._writer_db:
+            for d_type, values in rows.items():
+                self._writer_db.executemany(SQL_CMD[d_type]['upsert'], values)
+        metrics.count("db_rows_written", len(batch))
+
+    def _close_writer_db(self):
+        if self._writer_db is not None:
+            self._writer_db.close()
+            self._writer_db = None
+
+
+class AccountManifest(object):
+    """ The manifest store as seen by one of several accounts sharing it.
+
+    The files are recorded by path, so the accounts share the records (and
+    the deduplication) of the files they download into the same directory.
+    The listing fingerprints are kept per account though, since a course
+    crawled by one account is not downloaded into the directory of another.
+    """
+
+    def __init__(self, store, account):
+        self.store = store
+        self.account = account
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def lookup_listing(self, course, collection_id, max_age):
+        return self.store.lookup_listing(f'{self.account} {course}', collection_id, max_age)
+
+    def record_listings(self, course, fingerprints):
+        self.store.record_listings(f'{self.account} {course}', fingerprints)
@@ -0,0 +1,135 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : metrics.py
+@Description: Timed spans and counters of a run, exported as JSON and Prometheus text.
+'''
+
+import json
+import os
+import time
+from datetime import datetime
+
+from src.configs import METRICS
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+class Span(object):
+    """ Time a phase in a with or async with block. """
+
+    def __init__(self, metrics, key):
+        self.metrics = metrics
+        self.key = key
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.key, time.perf_counter() - self.start, exc_type is not None)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.__exit__(exc_type, exc, tb)
+
+
+class Metrics(object):
+    """ Durations of the phases and counters of a run.
+
+    Spans and counters are keyed by a name and optional labels, e.g.
+    metrics.span("download", type="video"). Spans nest freely, so the
+    durations of concurrent spans add up to more than the wall time.
+    """
+
+    def __init__(self):
+        self.started = datetime.now()
+        self.spans = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def span(self, name, **labels):
+        return Span(self, _key(name, labels))
+
+    def observe(self, key, seconds, failed=False):
+        span = self.spans.setdefault(key, {"count": 0, "errors": 0, "seconds": 0.0, "max": 0.0})
+        span["count"] += 1
+        span["errors"] += int(failed)
+        span["seconds"] += seconds
+        span["max"] = max(span["max"], seconds)
+
+    def count(self, name, value=1, **labels):
+        key = _key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        self.gauges[_key(name, labels)] = value
+
+    def report(self):
+        """ Get the report of the run as a JSON serializable dictionary. """
+        def entries(items, fields):
+            return [dict(name=name, labels=dict(labels), **fields(value))
+                    for (name, labels), value in sorted(items.items())]
+        return {
+            "started": self.started.isoformat(timespec='seconds'),
+            "seconds": round((datetime.now() - self.started).total_seconds(), 3),
+            "spans": entries(self.spans, lambda s: dict(s, seconds=round(s["seconds"], 3),
+                                                         max=round(s["max"], 3))),
+            "counters": entries(self.counters, lambda v: {"value": v}),
+            "gauges": entries(self.gauges, lambda v: {"value": v})
+        }
+
+    def prometheus(self, prefix=METRICS["prefix"]):
+        """ Get the metrics in the Prometheus text exposition format. """
+        def labels_of(labels):
+            if not labels:
+                return ''
+            pairs = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                             for k, v in labels)
+            return '{' + pairs + '}'
+
+        lines = []
+
+        def family(name, kind, samples):
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(f'{name}{labels_of(labels)} {value}' for labels, value in samples)
+
+        phases = sorted(self.spans.items())
+        family(f'{prefix}_phase_seconds_total', 'counter',
+               [((('phase', n),) + l, round(s["seconds"], 6)) for (n, l), s in phases])
+        family(f'{prefix}_phase_count_total', 'counter',
+               [((('phase', n),) + l, s["count"]) for (n, l), s in phases])
+        family(f'{prefix}_phase_errors_total', 'counter',
+               [((('phase', n),) + l, s["errors"]) for (n, l), s in phases])
+        family(f'{prefix}_phase_max_seconds', 'gauge',
+               [((('phase', n),) + l, round(s["max"], 6)) for (n, l), s in phases])
+        for items, kind, suffix in ((self.counters, 'counter', '_total'), (self.gauges, 'gauge', '')):
+            names = sorted({name for name, _ in items})
+            for name in names:
+                family(f'{prefix}_{name}{suffix}', kind,
+                       [(l, v) for (n, l), v in sorted(items.items()) if n == name])
+        family(f'{prefix}_run_seconds', 'gauge',
+               [((), round((datetime.now() - self.started).total_seconds(), 3))])
+        family(f'{prefix}_last_run_timestamp_seconds', 'gauge', [((), round(time.time()))])
+        return '\n'.join(lines) + '\n'
+
+    def export(self, directory, config=METRICS):
+        """ Write the JSON report and the Prometheus text file into directory.
+        The files are replaced atomically, so readers never see half of them.
+        """
+        outputs = ((config["json"], lambda: json.dumps(self.report(), ensure_ascii=False, indent=2)),
+                   (config["prometheus"], self.prometheus))
+        for filename, render in outputs:
+            if not filename:
+                continue
+            path = os.path.join(directory, filename)
+            with open(path + '.tmp', 'w', encoding='utf-8') as fd:
+                fd.write(render())
+            os.replace(path + '.tmp', path)
+
+
+metrics = Metrics()
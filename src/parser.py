@@ -0,0 +1,55 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : parser.py
+@Description: Pluggable HTML parser with targeted partial parsing.
+'''
+
+import importlib
+from bs4 import (BeautifulSoup, SoupStrainer)
+
+from src.configs import HTML_PARSER
+
+
+def get_backend():
+    """ Get the first installed backend of HTML_PARSER["backends"]. """
+    for backend in HTML_PARSER["backends"]:
+        if backend == 'html.parser':
+            return backend
+        try:
+            importlib.import_module(backend)
+            return backend
+        except ImportError:
+            continue
+    return 'html.parser'
+
+
+BACKEND = get_backend()
+
+# The elements which are needed by the extractors of every page type.
+STRAINERS = {
+    # the tab of the target page in the course main page
+    "course": SoupStrainer('a'),
+    # files, subfolders, the form and the sakai_csrf_token of resource pages
+    "courseware": SoupStrainer(['form', 'tr', 'input']),
+    "video": SoupStrainer('div', {'class': 'col'}),
+    "video_play": SoupStrainer(['video', 'h2']),
+    "homework": SoupStrainer('tr'),
+    "login": SoupStrainer('li')
+}
+
+
+def make_soup(text, page=None, backend=None, partial=None):
+    """ Parse the page.
+    Args:
+        text: String, the html of the page
+        page: String, the type of the page in STRAINERS, None to parse the whole page
+        backend: String, the backend of BeautifulSoup, None for BACKEND
+        partial: Boolean, whether to parse the needed elements only,
+                 None for HTML_PARSER["partial"]
+    Returns:
+        soup: BeautifulSoup Object
+    """
+    if partial is None:
+        partial = HTML_PARSER["partial"]
+    parse_only = STRAINERS.get(page) if partial else None
+    return BeautifulSoup(text, backend or BACKEND, parse_only=parse_only)
@@ -0,0 +1,91 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : process.py
+@Description: Pool of external processes and progress of youtube-dl.
+'''
+
+import asyncio
+import collections
+import re
+import time
+
+UNITS = {'B': 0, 'KIB': 1, 'MIB': 2, 'GIB': 3, 'TIB': 4}
+
+
+def parse_bytes(number, unit):
+    """ Parse the size printed by youtube-dl, e.g. ('1.23', 'MiB'), into bytes. """
+    return int(float(number) * (1 << (10 * UNITS.get(unit.upper(), 0))))
+
+
+class ExternalProcessPool(object):
+    """ Run external programs without a shell, at most limit of them at the same time. """
+
+    def __init__(self, limit):
+        self._slots = asyncio.Semaphore(limit)
+        self.running = 0
+
+    async def run(self, args, on_line=None):
+        """ Run the program and feed every line of its output to on_line.
+        Args:
+            args: List of the program and its arguments
+            on_line: function called with every line of stdout and stderr
+        Returns:
+            returncode: Integer, the exit code of the program
+            tail: List of the last lines of the output
+        """
+        async with self._slots:
+            self.running += 1
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *args,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.STDOUT)
+                tail = collections.deque(maxlen=10)
+                try:
+                    while True:
+                        line = await proc.stdout.readline()
+                        if not line:
+                            break
+                        line = line.decode(errors='ignore').rstrip()
+                        tail.append(line)
+                        if on_line is not None:
+                            on_line(line)
+                    returncode = await proc.wait()
+                except asyncio.CancelledError:
+                    proc.kill()
+                    await proc.wait()
+                    raise
+                return returncode, list(tail)
+            finally:
+                self.running -= 1
+
+
+class YoutubeDlProgress(object):
+    """ Progress of a video parsed from the output of youtube-dl --newline. """
+    PATTERN = re.compile(r'\[download\]\s+([\d.]+)% of\s+~?([\d.]+)(\w+)'
+                         r'(?:\s+at\s+([\d.]+)(\w+)/s)?')
+
+    def __init__(self):
+        self.percent = 0.0
+        self.total_bytes = 0
+        self.rate = 0
+        self.start = time.time()
+
+    @property
+    def downloaded_bytes(self):
+        return int(self.total_bytes * self.percent / 100)
+
+    @property
+    def average_rate(self):
+        """ Bytes per second since the progress is created. """
+        elapsed = time.time() - self.start
+        return self.downloaded_bytes / elapsed if elapsed > 0 else 0
+
+    def feed(self, line):
+        match = self.PATTERN.search(line)
+        if not match:
+            return
+        self.percent = float(match.group(1))
+        self.total_bytes = parse_bytes(match.group(2), match.group(3))
+        if match.group(4):
+            self.rate = parse_bytes(match.group(4), match.group(5))
@@ -0,0 +1,152 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : retry.py
+@Description: Retry policy with jittered backoff, retry budget and per-host circuit breakers.
+'''
+
+import asyncio
+import random
+import time
+from urllib import parse
+
+from aiohttp import (ClientConnectionError, ClientPayloadError, ClientResponseError)
+
+from src.configs import RETRY
+from src.logger import logger
+
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class TransientError(IOError):
+    """ Error which is worth retrying, e.g. a truncated download. """
+
+
+def is_transient(e):
+    """ Classify the error: network errors, timeouts and server errors are
+    retried, while client errors (e.g. 404) and local errors are not.
+    """
+    if isinstance(e, ClientResponseError):
+        return e.status in RETRY_STATUS
+    return isinstance(e, (ClientConnectionError, ClientPayloadError, asyncio.TimeoutError,
+                          ConnectionError, TransientError))
+
+
+def retry_after(e):
+    """ Get the delay in the Retry-After header of the error if any. """
+    headers = getattr(e, 'headers', None) or {}
+    value = headers.get('Retry-After', '')
+    return float(value) if value.isdigit() else None
+
+
+class CircuitBreaker(object):
+    """ Pause the requests to a host which keeps failing.
+
+    After failure_threshold consecutive failures the breaker opens, and
+    the requests wait until the cooldown is over. Then the breaker is
+    half open: a single failure opens it again, a success closes it.
+    """
+
+    def __init__(self, failure_threshold, cooldown):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0
+        self.half_open = False
+        self.trips = 0
+
+    async def wait(self):
+        """ Wait until the breaker is not open. """
+        while True:
+            delay = self.open_until - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+
+    def success(self):
+        self.failures = 0
+        self.half_open = False
+
+    def failure(self):
+        self.failures += 1
+        if self.half_open or self.failures >= self.failure_threshold:
+            self.open_until = time.monotonic() + self.cooldown
+            self.failures = 0
+            self.half_open = True
+            self.trips += 1
+            return True
+        return False
+
+
+class RetryPolicy(object):
+    """ Run coroutines with retries, shared by all the requests of a run. """
+
+    def __init__(self, config=RETRY):
+        self.attempts = config["attempts"]
+        self.base_delay = config["base_delay"]
+        self.max_delay = config["max_delay"]
+        self.budget_min = config["budget_min"]
+        self.budget_ratio = config["budget_ratio"]
+        self.breaker_config = config["breaker"]
+        self.breakers = {}
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+
+    def breaker(self, url):
+        """ Get the circuit breaker of the host of url. """
+        host = parse.urlsplit(url).hostname or ''
+        if host not in self.breakers:
+            self.breakers[host] = CircuitBreaker(**self.breaker_config)
+        return self.breakers[host]
+
+    def has_budget(self):
+        return self.retries < self.budget_min + self.budget_ratio * self.calls
+
+    def backoff(self, attempt):
+        """ Full jitter: random delay in [0, min(max_delay, base_delay * 2^attempt)). """
+        return random.uniform(0, min(self.max_delay, self.base_delay * (1 << attempt)))
+
+    async def call(self, url, func):
+        """ Call coroutine function func until it succeeds.
+
+        Args:
+            url: String, the url requested by func, whose host decides the breaker
+            func: coroutine function without arguments, called once per attempt
+        Returns:
+            the result of func
+        Raises:
+            the last error if it is not transient, or no attempts or budget is left
+        """
+        self.calls += 1
+        breaker = self.breaker(url)
+        for attempt in range(self.attempts):
+            await breaker.wait()
+            try:
+                result = await func()
+            except Exception as e:
+                if not is_transient(e):
+                    raise
+                self.failures += 1
+                if breaker.failure():
+                    logger.info(
+                        f'Too many failures of {parse.urlsplit(url).hostname}, pausing it for {breaker.cooldown} seconds.')
+                if attempt == self.attempts - 1 or not self.has_budget():
+                    raise
+                self.retries += 1
+                delay = retry_after(e) or self.backoff(attempt)
+                logger.info(f'{type(e).__name__} {e}, retrying {url} in {delay:.1f} seconds...')
+                await asyncio.sleep(delay)
+            else:
+                breaker.success()
+                return result
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "breaker_trips": sum(b.trips for b in self.breakers.values())
+        }
+
+
+policy = RetryPolicy()
@@ -0,0 +1,263 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : scheduler.py
+@Description: Schedulers for running crawling and downloading tasks concurrently.
+'''
+
+import asyncio
+import itertools
+from urllib import parse
+
+from src.configs import (ACCOUNTS, ADAPTIVE_CONCURRENCY, CRAWL_LIMITS, DOWNLOAD_LIMITS)
+from src.logger import logger
+from src.throttle import AimdController
+
+
+class HostLimiter(object):
+    """ Semaphores which limit the concurrent tasks of every host. """
+
+    def __init__(self, host_limits, default_limit):
+        self._host_limits = host_limits
+        self._default_limit = default_limit
+        self._hosts = {}
+
+    def get(self, url):
+        """ Get the semaphore of the host of url. """
+        host = parse.urlsplit(url).hostname or ''
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(
+                self._host_limits.get(host, self._default_limit))
+        return self._hosts[host]
+
+
+class CrawlScheduler(object):
+    """ Run crawling coroutines under a global limit and per-host limits.
+
+    The global limit bounds how many items (e.g. courses) are processed
+    at the same time, while the per-host limits bound how many requests
+    are sent to the same host at the same time.
+    """
+
+    def __init__(self, limits=CRAWL_LIMITS):
+        self._global = asyncio.Semaphore(limits["global"])
+        self._hosts = HostLimiter(limits["per_host"], limits["default_per_host"])
+
+    def host(self, url):
+        """ Get the semaphore which limits the requests sent to the host of url. """
+        return self._hosts.get(url)
+
+    async def map(self, func, items):
+        """ Apply coroutine function func to all items concurrently.
+
+        Args:
+            func: coroutine function, called with one item
+            items: list of items
+        Returns:
+            results: list, results of func in the same order as items
+        """
+        async def worker(item):
+            async with self._global:
+                return await func(item)
+        return await asyncio.gather(*[worker(item) for item in items])
+
+
+class DownloadBudget(object):
+    """ The per-host limits and the concurrency limit of the running downloads.
+
+    A budget may be shared by the download schedulers of several accounts,
+    then their workers together stay within it. The concurrency limit is
+    adjusted by the AIMD controller if the adaptive concurrency is enabled,
+    otherwise it is fixed to maximum.
+    """
+
+    def __init__(self, maximum, limits=DOWNLOAD_LIMITS, adaptive=ADAPTIVE_CONCURRENCY):
+        self.hosts = HostLimiter(limits["per_host"], limits["default_per_host"])
+        self.controller = AimdController(maximum, adaptive) if adaptive["enabled"] else None
+        self._slots = asyncio.Semaphore(maximum)
+        self._users = 0
+        self._controller_task = None
+
+    async def acquire(self):
+        if self.controller is not None:
+            await self.controller.acquire()
+        else:
+            await self._slots.acquire()
+
+    async def release(self):
+        if self.controller is not None:
+            await self.controller.release()
+        else:
+            self._slots.release()
+
+    def start(self):
+        """ Start the controller when the first scheduler starts. """
+        self._users += 1
+        if self.controller is not None and self._controller_task is None:
+            self._controller_task = asyncio.create_task(self.controller.run())
+
+    async def stop(self):
+        """ Stop the controller when the last scheduler stops. """
+        self._users -= 1
+        if self._users == 0 and self._controller_task is not None:
+            self._controller_task.cancel()
+            await asyncio.gather(self._controller_task, return_exceptions=True)
+            self._controller_task = None
+
+
+class SharedLimits(object):
+    """ The crawl scheduler and the download budgets shared by the managers
+    of several accounts, so that the accounts together send no more
+    requests than the limits of ACCOUNTS.
+    """
+
+    def __init__(self, config=ACCOUNTS):
+        self.crawl = CrawlScheduler(dict(CRAWL_LIMITS, **{
+            "global": config["crawl_global"], "per_host": config["crawl_per_host"]}))
+        self._download_limits = dict(DOWNLOAD_LIMITS, per_host=config["download_per_host"])
+        self._download_workers = config["download_workers"]
+        self._downloads = {}
+
+    def download(self, m_type):
+        """ Get the download budget of the managers of m_type. """
+        if m_type not in self._downloads:
+            self._downloads[m_type] = DownloadBudget(self._download_workers[m_type], self._download_limits)
+        return self._downloads[m_type]
+
+
+class DownloadScheduler(object):
+    """ Run download jobs with a fixed pool of workers.
+
+    Jobs wait in a bounded priority queue, the smaller the priority the
+    earlier the job runs. Jobs of the same priority run in the order they
+    are put. The running jobs are limited by the download budget, per host
+    and in total.
+    """
+    _STOP = (float('inf'),)
+
+    def __init__(self, run, workers, limits=DOWNLOAD_LIMITS, adaptive=ADAPTIVE_CONCURRENCY, budget=None):
+        """
+        Args:
+            run: coroutine function, called with one job
+            workers: Integer, the number of workers
+            limits: Dictionary, the limits of the queue and the hosts
+            adaptive: Dictionary, the config of the AIMD controller
+            budget: DownloadBudget shared with other schedulers, None for
+                    a budget of this scheduler alone
+        """
+        self._run = run
+        self._workers = workers
+        self._queue = asyncio.PriorityQueue(limits["queue_size"])
+        self._budget = budget or DownloadBudget(workers, limits, adaptive)
+        self._counter = itertools.count()
+        self._tasks = []
+        self.controller = self._budget.controller
+        self.active = 0
+        self.finished = 0
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            "workers": self._workers,
+            "active_workers": self.active,
+            "queue_depth": self.queue_depth,
+            "finished": self.finished,
+            "concurrency": self.controller.report() if self.controller else None
+        }
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work())
+                       for _ in range(self._workers)]
+        self._budget.start()
+
+    async def put(self, job, priority, url):
+        """ Put the job into the queue, wait if the queue is full.
+
+        Args:
+            job: the argument of the run function
+            priority: Tuple of numbers
+            url: String, the url which the job downloads from
+        """
+        await self._queue.put((priority, next(self._counter), url, job))
+
+    async def join(self):
+        """ Wait until all the jobs are done and stop the workers. """
+        for _ in self._tasks:
+            await self._queue.put((self._STOP, next(self._counter), '', None))
+        await asyncio.gather(*self._tasks)
+        self._tasks = []
+        await self._budget.stop()
+
+    async def _work(self):
+        while True:
+            priority, _, url, job = await self._queue.get()
+            if priority == self._STOP:
+                break
+            await self._budget.acquire()
+            try:
+                async with self._budget.hosts.get(url):
+                    self.active += 1
+                    try:
+                        await self._run(job)
+                    except Exception as e:
+                        logger.error(f'{type(e)}, {e}')
+                    finally:
+                        self.active -= 1
+                        self.finished += 1
+            finally:
+                await self._budget.release()
+
+
+class ReadWriteLock(object):
+    """ Lock which is shared by many holders or owned by one exclusive holder.
+
+    Waiting exclusive holders block new shared holders, so that they are
+    not starved.
+    """
+
+    def __init__(self):
+        self._cond = asyncio.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._waiting = 0
+
+    async def acquire_shared(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: not self._exclusive and self._waiting == 0)
+            self._shared += 1
+
+    async def release_shared(self):
+        async with self._cond:
+            self._shared -= 1
+            self._cond.notify_all()
+
+    async def acquire_exclusive(self):
+        async with self._cond:
+            self._waiting += 1
+            await self._cond.wait_for(lambda: not self._exclusive and self._shared == 0)
+            self._waiting -= 1
+            self._exclusive = True
+
+    async def release_exclusive(self):
+        async with self._cond:
+            self._exclusive = False
+            self._cond.notify_all()
+
+    def pair(self):
+        """ Get the (shared, exclusive) context managers of this lock. """
+        return (_LockView(self.acquire_shared, self.release_shared),
+                _LockView(self.acquire_exclusive, self.release_exclusive))
+
+
+class _LockView(object):
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    async def __aenter__(self):
+        await self._acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._release()
@@ -0,0 +1,137 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : segmented.py
+@Description: Download large files in concurrent Range segments.
+'''
+
+import asyncio
+import os
+import re
+
+from src.configs import (HTTP_HDRS, SEGMENTED_DOWNLOAD)
+from src.logger import logger
+from src.retry import TransientError
+from src.transport import get_timeout
+from src.writer import stream_to_file
+
+
+async def probe_range(session, url):
+    """ Check whether the server supports Range requests of url.
+    Returns:
+        (length, validator, etag): Tuple, the length of the file, its ETag
+                                   (or Last-Modified) and its ETag (None if
+                                   not given), None if Range is not supported
+    """
+    headers = dict(HTTP_HDRS['download'])
+    headers['Range'] = 'bytes=0-0'
+    async with session.get(url, headers=headers, timeout=get_timeout("page")) as resp:
+        if resp.status != 206:
+            return None
+        match = re.match(r'bytes 0-0/(\d+)', resp.headers.get('Content-Range', ''))
+        if not match:
+            return None
+        etag = resp.headers.get('ETag')
+        return int(match.group(1)), etag or resp.headers.get('Last-Modified'), etag
+
+
+def should_segment(size, d_type):
+    """ Whether a file of size bytes is large enough to be downloaded in segments. """
+    return size is not None and size >= SEGMENTED_DOWNLOAD[d_type]["threshold"]
+
+
+class SegmentedDownloader(object):
+    """ Download one file in N concurrent Range segments.
+
+    The target file is preallocated to its full length, and every segment
+    writes into its own region of the file through its own file handle.
+    The progress of the segments is saved every "checkpoint_interval"
+    seconds and when the download stops, so that an interrupted or retried
+    download only fetches the unfinished ranges.
+    """
+
+    def __init__(self, session, url, path, length, validator=None, segments=4, progress=None, save=None):
+        """
+        Args:
+            progress: List of [start, end, received] of the segments of the
+                      interrupted download to resume, None to start anew
+            save: callable, called with the progress to save it, None for
+                  no saving
+        """
+        self.session = session
+        self.url = url
+        self.path = path
+        self.length = length
+        self.validator = validator
+        self.save = save
+        min_size = SEGMENTED_DOWNLOAD["min_segment_size"]
+        self.segments = max(1, min(segments, length // min_size))
+        self.resumed = bool(progress) and os.path.exists(path) and os.path.getsize(path) == length
+        # [start, end, received] of every segment
+        if self.resumed:
+            self.progress = [list(segment) for segment in progress]
+        else:
+            self.progress = [[start, end, 0] for start, end in self.split()]
+
+    def split(self):
+        """ Split the file into segments of [start, end] byte ranges. """
+        step = self.length // self.segments
+        ranges = []
+        for i in range(self.segments):
+            start = i * step
+            end = self.length - 1 if i == self.segments - 1 else start + step - 1
+            ranges.append((start, end))
+        return ranges
+
+    def checkpoint(self):
+        if self.save is not None:
+            self.save(self.progress)
+
+    async def save_periodically(self):
+        while True:
+            await asyncio.sleep(SEGMENTED_DOWNLOAD["checkpoint_interval"])
+            try:
+                self.checkpoint()
+            except OSError as e:
+                logger.error(f'{type(e)}, {e}')
+
+    async def run(self):
+        if not self.resumed:
+            with open(self.path, 'wb') as fd:
+                fd.truncate(self.length)
+        self.checkpoint()
+        tasks = [asyncio.create_task(self.fetch_segment(segment))
+                 for segment in self.progress if segment[2] < segment[1] + 1 - segment[0]]
+        saver = asyncio.create_task(self.save_periodically())
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            # wait until the cancelled segments have written what they received
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            saver.cancel()
+            self.checkpoint()
+
+    async def fetch_segment(self, segment):
+        start, end, received = segment
+        first = start + received
+        headers = dict(HTTP_HDRS['download'])
+        headers['Range'] = f'bytes={first}-{end}'
+        if self.validator:
+            headers['If-Range'] = self.validator
+        async with self.session.get(self.url, headers=headers, timeout=get_timeout("transfer")) as resp:
+            resp.raise_for_status()
+            # the file has been changed or the range is ignored by the server
+            content_range = re.match(r'bytes (\d+)-', resp.headers.get('Content-Range', ''))
+            if resp.status != 206 or not content_range or int(content_range.group(1)) != first:
+                raise TransientError(f'Range request of {self.url} is not answered with 206.')
+
+            def written(nbytes):
+                segment[2] = received + nbytes
+            with open(self.path, 'r+b') as fd:
+                fd.seek(first)
+                await stream_to_file(resp, fd, limit=end + 1 - first, progress=written)
+        if segment[2] < end + 1 - start:
+            raise TransientError(f'Incomplete segment {start}-{end} of {self.url}.')
@@ -0,0 +1,99 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : session.py
+@Description: Encrypted store of the cookies of the logged in session.
+'''
+
+import base64
+import hashlib
+import json
+import os
+from http.cookies import Morsel
+
+from yarl import URL
+
+from src.configs import SESSION_STORE
+from src.logger import logger
+
+try:
+    from cryptography.fernet import (Fernet, InvalidToken)
+except ImportError:
+    Fernet = None
+
+
+class SessionStore(object):
+    """ Save and load the cookies of an aiohttp CookieJar, encrypted at rest.
+
+    The key is derived from the secret (e.g. the username and password) by
+    PBKDF2 with a random salt, which is saved before the Fernet token.
+    The cookies are saved with their attributes and whether they are
+    host-only, and restored through CookieJar.update_cookies.
+    """
+    SALT_SIZE = 16
+
+    def __init__(self, path, secret):
+        self.path = path
+        self.secret = secret.encode('utf-8')
+
+    @property
+    def available(self):
+        return Fernet is not None
+
+    def _fernet(self, salt):
+        key = hashlib.pbkdf2_hmac('sha256', self.secret, salt, SESSION_STORE["iterations"])
+        return Fernet(base64.urlsafe_b64encode(key))
+
+    def save(self, cookie_jar):
+        if not self.available:
+            logger.warning('cryptography is not installed, the session is not kept between runs.')
+            return
+        salt = os.urandom(self.SALT_SIZE)
+        cookies = [{'key': morsel.key, 'value': morsel.value, 'coded_value': morsel.coded_value,
+                    'attributes': {name: value for name, value in morsel.items() if value},
+                    'host_only': self.is_host_only(cookie_jar, morsel)}
+                   for morsel in cookie_jar]
+        data = json.dumps(cookies).encode('utf-8')
+        token = self._fernet(salt).encrypt(data)
+        try:
+            with open(self.path, 'wb') as fd:
+                fd.write(salt + token)
+        except OSError as e:
+            logger.error(f'{type(e)}, {e}')
+
+    def load(self, cookie_jar):
+        """ Load the saved cookies into cookie_jar.
+        Returns:
+            tag: True if loaded, False if there are no valid saved cookies
+        """
+        if not self.available or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'rb') as fd:
+                content = fd.read()
+            salt, token = content[:self.SALT_SIZE], content[self.SALT_SIZE:]
+            cookies = json.loads(self._fernet(salt).decrypt(token, ttl=SESSION_STORE["max_age"]))
+        except (OSError, InvalidToken, ValueError):
+            # expired, saved by another user or by an older version
+            self.clear()
+            return False
+        for cookie in cookies:
+            morsel = Morsel()
+            morsel.set(cookie['key'], cookie['value'], cookie['coded_value'])
+            morsel.update(cookie['attributes'])
+            domain = morsel['domain']
+            if cookie['host_only']:
+                # a cookie without domain is kept for the host of the url only
+                morsel['domain'] = ''
+            cookie_jar.update_cookies({cookie['key']: morsel}, URL.build(scheme='https', host=domain))
+        return True
+
+    @staticmethod
+    def is_host_only(cookie_jar, morsel):
+        """ Whether the cookie is only sent to its own host, i.e. not to its subdomains. """
+        url = URL.build(scheme='https', host=f'sub.{morsel["domain"]}', path=morsel['path'] or '/')
+        sent = cookie_jar.filter_cookies(url).get(morsel.key)
+        return sent is None or sent.value != morsel.value
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
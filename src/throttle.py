@@ -0,0 +1,163 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : throttle.py
+@Description: Global bandwidth cap and adaptive download concurrency.
+'''
+
+import asyncio
+from collections import Counter
+
+from src.configs import (ADAPTIVE_CONCURRENCY, BANDWIDTH)
+from src.logger import logger
+from src.retry import policy as retry_policy
+from src.transport import stats as transport_stats
+
+
+class TokenBucket(object):
+    """ Token bucket which caps the byte rate of all the downloads.
+
+    Tokens are refilled at rate bytes per second up to burst. A consumer
+    which takes more tokens than there are waits until the debt is paid,
+    and the consumers are served in order.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.total = 0
+        self.waited = 0.0
+        self._updated = None
+        self._lock = None
+
+    async def consume(self, nbytes):
+        self.total += nbytes
+        if not self.rate:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            now = asyncio.get_event_loop().time()
+            if self._updated is not None:
+                self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= nbytes
+            if self.tokens < 0:
+                delay = -self.tokens / self.rate
+                self.waited += delay
+                await asyncio.sleep(delay)
+
+
+bandwidth = TokenBucket(BANDWIDTH["rate"], BANDWIDTH["burst"])
+
+
+class AimdController(object):
+    """ Limit the number of active downloads by additive increase and
+    multiplicative decrease.
+
+    Every interval the controller samples the throughput of the token
+    bucket, the latency of the requests and the failures of the retry
+    policy. The limit shrinks on errors or high latency, and grows when
+    all the slots were busy, the bandwidth cap is not binding (the bucket
+    kept the downloads waiting for less than half of the interval) and
+    the last increase paid off.
+    """
+
+    def __init__(self, maximum, config=ADAPTIVE_CONCURRENCY, bucket=bandwidth):
+        self.maximum = maximum
+        self.minimum = min(config["min"], maximum)
+        self.limit = max(self.minimum, min(config["initial"], maximum))
+        self.interval = config["interval"]
+        self.increase = config["increase"]
+        self.decrease = config["decrease"]
+        self.error_rate = config["error_rate"]
+        self.latency_factor = config["latency_factor"]
+        self.bucket = bucket
+        self.active = 0
+        self.history = []
+        self.throughput = 0.0
+        self._peak = 0
+        self._base_latency = None
+        self._grown = False
+        self._cond = None
+
+    def _condition(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self):
+        async with self._condition():
+            await self._cond.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+            self._peak = max(self._peak, self.active)
+
+    async def release(self):
+        async with self._condition():
+            self.active -= 1
+            self._cond.notify_all()
+
+    def _snapshot(self):
+        return (self.bucket.total, self.bucket.waited, transport_stats.latency,
+                transport_stats.responses, retry_policy.calls, retry_policy.failures)
+
+    def adjust(self, throughput, latency, error_rate, saturated, capped):
+        """ Get the next limit from the sample of the last interval.
+        Args:
+            throughput: Float, bytes per second
+            latency: Float, mean latency in seconds, None if no responses
+            error_rate: Float, failures per request
+            saturated: Boolean, whether all the slots were busy
+            capped: Boolean, whether the bandwidth cap was binding
+        """
+        if latency is not None:
+            self._base_latency = latency if self._base_latency is None \
+                else min(self._base_latency, latency)
+        congested = error_rate > self.error_rate or (
+            latency is not None and latency > self.latency_factor * self._base_latency)
+        paid_off = not self._grown or throughput > 1.05 * self.throughput
+        limit = self.limit
+        if congested:
+            limit = max(self.minimum, int(self.limit * self.decrease))
+        elif saturated and not capped and paid_off:
+            limit = min(self.maximum, self.limit + self.increase)
+        self._grown = limit > self.limit
+        self.throughput = throughput
+        return limit
+
+    async def run(self):
+        """ Adjust the limit every interval until cancelled. """
+        last = self._snapshot()
+        while True:
+            await asyncio.sleep(self.interval)
+            now = self._snapshot()
+            nbytes, waited, latency, responses, calls, failures = [b - a for a, b in zip(last, now)]
+            last = now
+            saturated = self._peak >= self.limit
+            self._peak = self.active
+            if not nbytes and not responses and not self.active:
+                continue
+            limit = self.adjust(nbytes / self.interval,
+                                latency / responses if responses else None,
+                                failures / calls if calls else 0.0, saturated,
+                                waited >= 0.5 * self.interval)
+            if limit != self.limit:
+                logger.debug(f'Download concurrency {self.limit} -> {limit}.')
+                async with self._condition():
+                    self.limit = limit
+                    self._cond.notify_all()
+            self.history.append(self.limit)
+
+    def settled(self):
+        """ The most frequent limit of the recent intervals. """
+        if not self.history:
+            return self.limit
+        return Counter(self.history[-10:]).most_common(1)[0][0]
+
+    def report(self):
+        return {
+            "limit": self.limit,
+            "settled_limit": self.settled(),
+            "max_limit": max(self.history, default=self.limit),
+            "throughput": round(self.throughput)
+        }
@@ -0,0 +1,88 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : transport.py
+@Description: Tuned HTTP session with a shared connection pool and timeout profiles.
+'''
+
+import asyncio
+
+from aiohttp import (ClientSession, ClientTimeout, TCPConnector, TraceConfig)
+
+from src.configs import (TRANSPORT, TIMEOUTS)
+
+
+def get_timeout(profile):
+    """ Get the ClientTimeout of the profile in TIMEOUTS. """
+    return ClientTimeout(**TIMEOUTS[profile])
+
+
+class ConnectionStats(object):
+    """ Count the requests and how many of them reuse pooled connections.
+
+    The latency of a request is the time until its response headers arrive.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.created = 0
+        self.reused = 0
+        self.responses = 0
+        self.latency = 0.0
+        self.trace_config = TraceConfig()
+        self.trace_config.on_request_start.append(self._on_request_start)
+        self.trace_config.on_request_end.append(self._on_request_end)
+        self.trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        self.trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+
+    async def _on_request_start(self, session, context, params):
+        self.requests += 1
+        context.start = asyncio.get_event_loop().time()
+
+    async def _on_request_end(self, session, context, params):
+        self.responses += 1
+        self.latency += asyncio.get_event_loop().time() - context.start
+
+    async def _on_connection_create_end(self, session, context, params):
+        self.created += 1
+
+    async def _on_connection_reuseconn(self, session, context, params):
+        self.reused += 1
+
+    def report(self):
+        connections = self.created + self.reused
+        return {
+            "requests": self.requests,
+            "connections_created": self.created,
+            "connections_reused": self.reused,
+            "reuse_ratio": round(self.reused / connections, 3) if connections else 0.0,
+            "mean_latency": round(self.latency / self.responses, 3) if self.responses else 0.0
+        }
+
+
+stats = ConnectionStats()
+
+
+def create_connector(resolver=None):
+    return TCPConnector(
+        resolver=resolver,
+        limit=TRANSPORT["limit"],
+        limit_per_host=TRANSPORT["limit_per_host"],
+        ttl_dns_cache=TRANSPORT["ttl_dns_cache"],
+        keepalive_timeout=TRANSPORT["keepalive_timeout"],
+        ssl=None if TRANSPORT["verify_ssl"] else False)
+
+
+def create_session(connector=None, cookie_jar=None, resolver=None):
+    """ Create the ClientSession on the shared pool, with the "page" timeout by default.
+    Args:
+        connector: TCPConnector shared with other sessions, None to create one
+                   which is owned by the session
+        cookie_jar: CookieJar of the session, None for a new one
+        resolver: aiohttp resolver of the created connector, None for the default one
+    """
+    return ClientSession(
+        connector=connector or create_connector(resolver),
+        connector_owner=connector is None,
+        cookie_jar=cookie_jar,
+        timeout=get_timeout("page"),
+        trace_configs=[stats.trace_config])
@@ -0,0 +1,121 @@
+# -*- encoding: utf-8 -*-
+'''
+@Filename   : writer.py
+@Description: Stream responses into files without blocking the event loop.
+'''
+
+import asyncio
+
+from src.configs import STREAM_IO
+from src.throttle import bandwidth
+
+
+class AdaptiveChunkSize(object):
+    """ Chunk size which adapts to the measured throughput.
+
+    The size is chosen so that one chunk takes about read_interval seconds
+    to arrive, rounded to a power of 2 between min_chunk and max_chunk.
+    """
+
+    def __init__(self, config=STREAM_IO):
+        self.minimum = config["min_chunk"]
+        self.maximum = config["max_chunk"]
+        self.interval = config["read_interval"]
+        self.size = self.minimum
+
+    def update(self, nbytes, elapsed):
+        if elapsed <= 0:
+            target = self.maximum
+        else:
+            target = nbytes / elapsed * self.interval
+        size = self.minimum
+        while size < target and size < self.maximum:
+            size <<= 1
+        self.size = size
+
+
+class BufferedWriter(object):
+    """ Batch chunks into a large buffer and write it in a thread pool.
+
+    At most one write is in flight, so the buffer is filled by the network
+    while the previous one is written to the disk, and the data is written
+    in order. Every write is flushed to the OS before it counts as written.
+    """
+
+    def __init__(self, fd, buffer_size=STREAM_IO["buffer_size"], progress=None):
+        """
+        Args:
+            progress: callable, called with the number of bytes written so far
+                      after every write, None for no callback
+        """
+        self.fd = fd
+        self.buffer_size = buffer_size
+        self.written = 0
+        self._progress = progress
+        self._buffer = bytearray()
+        self._pending = None
+
+    async def write(self, chunk):
+        self._buffer += chunk
+        if len(self._buffer) >= self.buffer_size:
+            await self.flush()
+
+    async def flush(self):
+        await self._wait()
+        if self._buffer:
+            data, self._buffer = bytes(self._buffer), bytearray()
+            loop = asyncio.get_event_loop()
+            self._pending = loop.run_in_executor(None, self._write, data)
+
+    async def close(self):
+        """ Write all the buffered data and wait until it is written. """
+        await self.flush()
+        await self._wait()
+
+    def _write(self, data):
+        self.fd.write(data)
+        self.fd.flush()
+        return len(data)
+
+    async def _wait(self):
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            self.written += await pending
+            if self._progress is not None:
+                self._progress(self.written)
+
+
+async def stream_to_file(resp, fd, limit=None, digest=None, progress=None):
+    """ Stream the body of the response into the opened file, under the
+    global bandwidth cap.
+    Args:
+        resp: aiohttp ClientResponse
+        fd: file object opened for writing at the right position
+        limit: Integer, the maximum number of bytes to write, None for no limit
+        digest: hashlib object updated with the written bytes, None for no hashing
+        progress: callable, called with the number of bytes written into the
+                  file so far, see BufferedWriter
+    Returns:
+        received: Integer, the number of bytes received
+    """
+    loop = asyncio.get_event_loop()
+    chunk_size = AdaptiveChunkSize()
+    writer = BufferedWriter(fd, progress=progress)
+    received = 0
+    try:
+        while True:
+            start = loop.time()
+            chunk = await resp.content.read(chunk_size.size)
+            if not chunk:
+                break
+            chunk_size.update(len(chunk), loop.time() - start)
+            await bandwidth.consume(len(chunk))
+            data = chunk if limit is None else chunk[:max(0, limit - received)]
+            if data:
+                if digest is not None:
+                    digest.update(data)
+                await writer.write(data)
+            received += len(chunk)
+    finally:
+        await writer.close()
+    return received